@@ -0,0 +1,178 @@
+from threading import Lock
+
+import pandas as pd
+import numpy as np
+
+from data.sqlalchemy import DBManager, QueryCache
+
+from utils.logger import LoggerSingleton
+log = LoggerSingleton().get_logger()
+
+GRAINS = ("day", "week", "month", "study_week")
+
+class AggregationCube:
+    '''
+    Hours of every (course, period) x subject x time bin of one grain, held as a dense
+    NumPy array, so that any chart or stat at that grain is a slice of it.
+    Grains:
+        - day : calendar day
+        - week : ISO (Mon-Sun) week, labeled by its Monday
+        - month : calendar month
+        - study_week : week N since the period start (week 1 holds the start)
+
+    Cubes are built from daily_data and memoised per database and grain until the next
+    write, using the QueryCache generation as data version (see AggregationCube.get()).
+    '''
+    _cubes = {}     # (db url, grain) -> cube
+    _lock = Lock()
+
+    def __init__(self, grain:str, generation:int, pairs:list[tuple], subjects:np.ndarray,
+            bins:np.ndarray, hours:np.ndarray, present:np.ndarray, extents:np.ndarray):
+        self.grain = grain
+        self.generation = generation
+        self.pairs = {pair: i for i, pair in enumerate(pairs)}
+        self.subjects = subjects    # (n_subjects,) subject names
+        self.bins = bins            # (n_bins,) datetime64[D] / datetime64[M] / week numbers
+        self.hours = hours          # (n_pairs, n_subjects, n_bins) hours
+        self.present = present      # (n_pairs, n_subjects) subjects logged in each pair
+        self.extents = extents      # (n_pairs, 2) first and last bin index of each pair
+
+    @classmethod
+    def get(cls, grain:str, db:DBManager | None = None) -> "AggregationCube":
+        '''
+        Cube of `grain` for the current data, rebuilt only after a write to the database.
+        '''
+        if grain not in GRAINS:
+            raise ValueError(f"Unknown grain '{grain}', expected one of {GRAINS}")
+        db = db or DBManager()
+
+        key = (str(db.engine.url), grain)
+        generation = QueryCache.generation()
+        with cls._lock:
+            cube = cls._cubes.get(key)
+        if cube is not None and cube.generation == generation:
+            return cube
+
+        cube = cls.build(grain, db, generation)
+        with cls._lock:
+            # Not kept when a write finished while it was built.
+            if generation == QueryCache.generation():
+                cls._cubes[key] = cube
+        return cube
+
+    @classmethod
+    def build(cls, grain:str, db:DBManager, generation:int = -1) -> "AggregationCube":
+        log.debug(f"Building {grain} aggregation cube.")
+
+        df = db.get_daily_data(densify=False)
+        df = df[df['subject'].notna()]
+        period_starts = db.get_period_starts()
+        first_days = {
+            pair: min(first_day, period_starts.get(pair, first_day))
+            for pair, first_day in db.get_first_days().items()
+        }
+
+        pair_index = pd.MultiIndex.from_frame(df[['course', 'period']])
+        pair_codes, pairs = pair_index.factorize()
+        subject_codes, subjects = pd.factorize(df['subject'], sort=True)
+
+        days = df['date'].to_numpy().astype('datetime64[D]')
+        pair_first_days = np.array(
+            [first_days.get(pair, pd.NaT) for pair in pairs], dtype='datetime64[D]'
+        )
+        pair_last_days = pair_first_days.copy()
+        np.maximum.at(pair_last_days, pair_codes, days)
+
+        day_bins = cls._to_bins(grain, days, pair_first_days[pair_codes])
+        first_bins = cls._to_bins(grain, pair_first_days, pair_first_days)
+        last_bins = cls._to_bins(grain, pair_last_days, pair_first_days)
+
+        if grain == "study_week":
+            origin = 1
+        else:
+            origin = first_bins.min() if len(first_bins) else 0
+        n_bins = int(last_bins.max() - origin + 1) if len(last_bins) else 0
+        bins = np.arange(origin, origin + n_bins)
+        if grain == "day":
+            bins = bins.astype('datetime64[D]')
+        elif grain == "week":
+            bins = (bins * 7 - 3).astype('datetime64[D]')
+        elif grain == "month":
+            bins = bins.astype('datetime64[M]')
+
+        # Dense (pair, subject, bin) array, summed in one pass.
+        shape = (len(pairs), len(subjects), n_bins)
+        flat = np.ravel_multi_index((pair_codes, subject_codes, day_bins - origin), shape)
+        hours = np.bincount(
+            flat, weights=df['time_spent_hrs'].to_numpy(), minlength=int(np.prod(shape))
+        ).reshape(shape).astype(np.float32)
+
+        present = np.zeros(shape[:2], dtype=bool)
+        present[pair_codes, subject_codes] = True
+        extents = np.stack([first_bins - origin, last_bins - origin], axis=1)
+
+        log.debug(f"{grain} cube of shape {shape}, {hours.nbytes/1024:.1f} KiB")
+        return cls(grain, generation, list(pairs), np.asarray(subjects), bins, hours, present, extents)
+
+    @staticmethod
+    def _to_bins(grain:str, days:np.ndarray, first_days:np.ndarray) -> np.ndarray:
+        '''
+        Integer bin of each datetime64[D] day: days, weeks or months since 1970-01-01
+        (as datetime64 does), or week number since each period's `first_days`.
+        '''
+        days = days.astype('datetime64[D]')
+        if grain == "day":
+            return days.astype(np.int64)
+        if grain == "month":
+            return days.astype('datetime64[M]').astype(np.int64)
+
+        # 1970-01-01 was a Thursday, so Mon-Sun weeks are counted from 1969-12-29.
+        weeks = (days.astype(np.int64) + 3) // 7
+        if grain == "week":
+            return weeks
+        return weeks - (first_days.astype(np.int64) + 3) // 7 + 1
+
+    def select(self, course:str, period:str, subjects:list | None = None,
+            start=None, end=None) -> pd.DataFrame:
+        '''
+        Hours of a course and period as a (bins x subjects) DataFrame, over all the bins from
+        its first day (or period start) to its last day, or from `start` to `end` (inclusive).
+        `start`/`end` are dates, or week numbers for the study_week grain.
+        '''
+        pair = self.pairs.get((course, period))
+        if pair is None:
+            return pd.DataFrame(columns=pd.Index([], name='subject'), dtype=self.hours.dtype)
+
+        first, last = self.extents[pair]
+        if start is not None:
+            first = max(first, self._bin_index(start))
+        if end is not None:
+            last = min(last, self._bin_index(end))
+
+        subject_idx = np.flatnonzero(self.present[pair])
+        if subjects is not None:
+            subject_idx = subject_idx[np.isin(self.subjects[subject_idx], subjects)]
+
+        hours = self.hours[pair, subject_idx, first:last + 1]
+        index = self.bins[first:last + 1]
+        if self.grain != "study_week":
+            index = pd.DatetimeIndex(index)
+        return pd.DataFrame(
+            hours.T,
+            index=pd.Index(index, name=self.grain),
+            columns=pd.Index(self.subjects[subject_idx], name='subject')
+        )
+
+    def totals(self, course:str, period:str, start=None, end=None) -> pd.Series:
+        '''
+        Hours of a course and period per bin, over all its subjects.
+        '''
+        return self.select(course, period, start=start, end=end).sum(axis=1)
+
+    def _bin_index(self, value) -> int:
+        if self.grain == "study_week":
+            return int(value) - 1
+
+        day = np.datetime64(pd.Timestamp(value).date(), 'D')
+        first_bin = self._to_bins(self.grain, self.bins[:1], self.bins[:1])
+        return int(self._to_bins(self.grain, np.array([day]), np.array([day]))[0] - first_bin[0])
@@ -6,21 +6,14 @@ log = LoggerSingleton().get_logger()
 
 class Charts:
     @classmethod
-    def plot_daily_stack_bar(cls, df):
+    def plot_daily_stack_bar(cls, df_pivot):
         '''
         Stacked bar chart for each day, each segment representing each subject.
+        `df_pivot` holds the hours of each day (index) and subject (columns), 
+        e.g. from AggregationCube.select().
         Rather than displaying all data from the start of the period, it should 
         display 1 or at max 2 weeks at a time.  
         '''
-        
-        df = df.sort_values(by='date')
-
-        df_pivot = df.pivot_table(
-            index='date',
-            columns='subject',
-            values='time_spent_hrs',
-            fill_value=0
-        )
         plt.style.use('seaborn-v0_8-paper')
         
         fig, ax = plt.subplots(figsize=(8, 4))
@@ -80,7 +73,7 @@ class Charts:
 
         df = df.sort_values(by='date')
         df = df[['course','period', 'date', 'time_spent_hrs']]    
-        df = df.groupby(['course', 'period', 'date'], as_index=False)['time_spent_hrs'].sum().reset_index()
+        df = df.groupby(['course', 'period', 'date'], as_index=False, observed=True)['time_spent_hrs'].sum().reset_index()
 
         if add_avg:
             df_avg_past = avg_past_courses(df, current_course)
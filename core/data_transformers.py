@@ -1,5 +1,7 @@
 import pandas as pd
+import numpy as np
 
+from utils.dtype_policy import DtypePolicy
 from utils.logger import LoggerSingleton
 log = LoggerSingleton().get_logger()
 
@@ -11,147 +13,170 @@ class DFTransformers:
             '1st Semester':'13-9-2021',
             '2nd Semester':'31-01-2022'
         }
+        Every (course, period, subject) gets a row for each day from the period start 
+        (or its first day in df_basic) to its last day, with 0 hours on the days without any.
         '''
-        def fill_missing_days(df, period):
-            '''
-                Used along the iteration. It selects the period values from the dataframe, 
-                    obtains the range of days from start to finish, merges it with the period df, 
-                    and fills the missing values (time spent = 0, periods with those that belong to it).
-            '''
-            df_period = df[df['period'] == period]
-            course_name = df_period['course'].iloc[0]
-            
-
-            if periods_start is not None:
-                period_min = pd.Timestamp(periods_start[period])
-            else:
-                period_min = pd.Timestamp(df_period['start_time'].min())
-            period_max = pd.Timestamp(df_period['start_time'].max())
-            
-            log.debug(f"Range of period {period}: "
-                f"{period_min.strftime('%d-%m-%Y')} to {period_max.strftime('%d-%m-%Y')} "
-                f"({((period_max - period_min) + pd.Timedelta(days=1)).days})."
-            )
-
-            full_range = pd.DataFrame({'start_time': pd.date_range(start=period_min, end=period_max)})
-
-            df_period = df[df['period'] == period].copy()
-            df_period['start_time'] = pd.to_datetime(df_period['start_time'])
-            full_range['start_time'] = pd.to_datetime(full_range['start_time'])
-            
-            df_merged = pd.merge(full_range, df_period, on='start_time', how='left')
-            
-            df_merged['time_spent_hrs'] = df_merged['time_spent_hrs'].fillna(0)
-            df_merged['period'] = df_merged['period'].ffill()
-
-            df_merged['date'] = df_merged['start_time'].apply(lambda x: (pd.Timestamp(x) - period_min).days)
-            
-            df_merged['period'] = df_merged['period'].ffill().fillna(period)
-
-            df_merged['course'] = course_name
-            log.debug(f"Consolidated from {len(df)} to {len(df_merged)} rows.")
-    
-            return df_merged
-        
         log.debug(f"Converting basic data to daily data.")
-        
-        wanted_cols = ['course', 'period', 'subject', 'time_spent_hrs', 'start_time']
-        df = df_basic[wanted_cols]
 
-        df.loc[:, 'start_time'] = pd.to_datetime(df['start_time'], errors='coerce')# .dt.date
-
-        df = df.groupby(['course','period','subject', 'start_time'], as_index=False,dropna=False).sum()
-
-        df_list = []
-        for period in df['period'].unique():
-            df_filled = fill_missing_days(df=df, period=period)
-            df_list.append(df_filled)
-
-        df = pd.concat(df_list, ignore_index=True)
-        
-        df['date'] = pd.to_datetime(df['start_time']).dt.date
-        df = df.drop(columns=['start_time'])
-
-        df['course'] = df['course'].ffill()
-        # df['subject'] = df['subject'].fillna('_missing_')
+        keys = ['course', 'period', 'subject']
+        df = df_basic[keys + ['time_spent_hrs', 'start_time']].copy()
+        df['start_time'] = pd.to_datetime(df['start_time'], errors='coerce').dt.normalize()
+        df = df.dropna(subset=['start_time'])
+
+        df['time_spent_hrs'] = df['time_spent_hrs'].astype('float64')
+        daily = df.groupby(keys + ['start_time'], dropna=False, observed=True)['time_spent_hrs'].sum()
+
+        # First and last day of each (course, period).
+        bounds = df.groupby(['course', 'period'], observed=True)['start_time'].agg(['min', 'max'])
+        if periods_start is not None:
+            starts = pd.Series(
+                [pd.Timestamp(periods_start[p]) if p in periods_start else pd.NaT 
+                 for p in bounds.index.get_level_values('period')],
+                index=bounds.index, dtype=bounds['min'].dtype
+            )
+            bounds['min'] = starts.fillna(bounds['min'])
+
+        # All the days of every period at once, from datetime64 offsets to its first day.
+        n_days = ((bounds['max'] - bounds['min']).dt.days + 1).clip(lower=0).to_numpy()
+        offsets = np.arange(n_days.sum()) - np.repeat(np.cumsum(n_days) - n_days, n_days)
+        days = pd.DataFrame({
+            'course': np.repeat(bounds.index.get_level_values('course'), n_days),
+            'period': np.repeat(bounds.index.get_level_values('period'), n_days),
+            'start_time': np.repeat(bounds['min'].to_numpy(), n_days) + offsets.astype('timedelta64[D]'),
+        })
+        log.debug(f"Ranges of periods:\n{bounds.assign(days=n_days)}")
+
+        # (course, period, subject, day) grid: each period's days times each of its subjects.
+        grid = days.merge(df[keys].drop_duplicates(), on=['course', 'period'])
+        full_index = pd.MultiIndex.from_frame(grid[keys + ['start_time']])
+
+        df = daily.reindex(full_index, fill_value=0).reset_index()
+        log.debug(f"Consolidated from {len(df_basic)} to {len(df)} rows.")
+
+        df['date'] = df['start_time']
+        return DtypePolicy.apply(
+            df[['course', 'period', 'subject', 'time_spent_hrs', 'date']], 
+            "basic_to_daily_clean", hours_dtype='float64'
+        )
 
-        return df
+    @staticmethod
+    def daily_delta(df_basic, changed_keys):
+        '''
+        Daily rows of only the `changed_keys` {(course, period, subject, day)}, with the hours 
+        summed from `df_basic`, which must hold every basic row of those days. 
+        Keys left without any row get 0 hours.
+        Same columns as basic_to_daily_clean().
+        '''
+        keys = ['course', 'period', 'subject']
+        changed = pd.DataFrame(list(changed_keys), columns=keys + ['start_time'])
+        changed['start_time'] = pd.to_datetime(changed['start_time']).dt.normalize()
+        changed_index = pd.MultiIndex.from_frame(changed.drop_duplicates())
+
+        df = df_basic[keys + ['time_spent_hrs', 'start_time']].copy()
+        df['start_time'] = pd.to_datetime(df['start_time'], errors='coerce').dt.normalize()
+        df['time_spent_hrs'] = df['time_spent_hrs'].astype('float64')
+        daily = df.groupby(keys + ['start_time'], dropna=False, observed=True)['time_spent_hrs'].sum()
+
+        df = daily.reindex(changed_index, fill_value=0).reset_index()
+        df['date'] = df['start_time']
+        return DtypePolicy.apply(
+            df[['course', 'period', 'subject', 'time_spent_hrs', 'date']], 
+            "daily_delta", hours_dtype='float64'
+        )
 
     @staticmethod
-    def daily_to_weekly_clean(df_daily):
-        ''' (generated w/ gpt o4-mini)
+    def daily_to_weekly_clean(df_daily, periods_start: dict | None = None, periods_subjects: dict | None = None):
+        '''
         Build a Mon-Sun weekly summary (including zero-hour weeks) from a daily hours DataFrame.
 
         Parameters
         ----------
         df_daily : pd.DataFrame
-            A daily-granularity table already zero-filled per period, with columns:
+            A daily-granularity table, with columns:
             - course : identifier for the course
             - period : academic period name
             - subject : subject name
-            - date : datetime.date for each day
+            - date : each day (datetime64[s] or datetime.date)
             - time_spent_hrs : hours logged on that day
+        periods_start : dict, optional
+            {period: first day}, to number weeks from the period start rather than from the
+            first week in `df_daily` (e.g. when only the latest weeks are recomputed).
+        periods_subjects : dict, optional
+            {period: subjects}, to zero-fill the weeks of subjects without any day in `df_daily`.
 
         Returns
         -------
         pd.DataFrame
             A weekly summary DataFrame containing:
             - course, period, subject
-            - week : a pandas Period (W-SUN) labeling each Mon-Sun week
+            - week : 'YYYY-MM-DD/YYYY-MM-DD' label of each Mon-Sun week
             - time_spent_hrs : total hours per week (zeros where no activity)
-            - week_number : sequential week index within each period
+            - week_number : week index within each period, 1 being the week of its start
         '''
         log.debug(f"Generating weekly hours")
 
-        df = df_daily.copy()
-        
-        df['date'] = pd.to_datetime(df['date'])
-        df['week'] = df['date'].dt.to_period('W-SUN') # .astype(str)
-        
-        weekly = (df
-            .groupby(['course','period','subject','week'], as_index=False)
+        keys = ['course', 'period', 'subject']
+        df = df_daily[keys + ['time_spent_hrs']].astype({'time_spent_hrs': 'float64'})
+        df['week'] = pd.to_datetime(df_daily['date']).dt.to_period('W-SUN').array.asi8
+
+        weekly = df.groupby(keys + ['week'], observed=True)['time_spent_hrs'].sum()
+
+        # Every week from the first to the last in df_daily, of each (course, period).
+        bounds = df.groupby(['course', 'period'], observed=True)['week'].agg(['min', 'max'])
+        n_weeks = (bounds['max'] - bounds['min'] + 1).to_numpy()
+        offsets = np.arange(n_weeks.sum()) - np.repeat(np.cumsum(n_weeks) - n_weeks, n_weeks)
+
+        first_weeks = bounds['min'].copy()
+        if periods_start is not None:
+            for (course, period) in bounds.index:
+                if period in periods_start:
+                    first_weeks[(course, period)] = pd.Timestamp(periods_start[period]).to_period('W-SUN').ordinal
+
+        weeks = pd.DataFrame({
+            'course': np.repeat(bounds.index.get_level_values('course'), n_weeks),
+            'period': np.repeat(bounds.index.get_level_values('period'), n_weeks),
+            'week': np.repeat(bounds['min'].to_numpy(), n_weeks) + offsets,
+            'first_week': np.repeat(first_weeks.to_numpy(), n_weeks),
+        })
+
+        # (course, period, subject, week) grid: each period's weeks times each of its subjects.
+        subjects = df[keys].dropna().drop_duplicates()
+        if periods_subjects is not None:
+            subjects = pd.concat([subjects, pd.DataFrame([
+                (course, period, subject)
+                for (course, period) in bounds.index if period in periods_subjects
+                for subject in periods_subjects[period]
+            ], columns=keys)]).drop_duplicates()
+        grid = weeks.merge(subjects, on=['course', 'period'])
+
+        grid['time_spent_hrs'] = weekly.reindex(
+            pd.MultiIndex.from_frame(grid[keys + ['week']]), fill_value=0
+        ).to_numpy()
+        grid['week_number'] = grid['week'] - grid['first_week'] + 1
+        grid['week'] = pd.PeriodIndex.from_ordinals(grid['week'], freq='W-SUN').astype(str)
+
+        result = grid[['course', 'period', 'subject', 'week', 'time_spent_hrs', 'week_number']]
+        log.debug(f"Produced {len(result)} weekly rows over {len(bounds)} periods")
+        return DtypePolicy.apply(result, "daily_to_weekly_clean", hours_dtype='float64')
+
+    @staticmethod
+    def daily_to_monthly_clean(df_daily):
+        '''
+        Calendar month totals per course, period and subject from a daily hours DataFrame
+        (same columns as in daily_to_weekly_clean()), with the month as 'YYYY-MM'.
+        '''
+        log.debug(f"Generating monthly hours")
+
+        df = df_daily.astype({'time_spent_hrs': 'float64'})
+        df['month'] = pd.to_datetime(df['date']).dt.to_period('M')
+
+        monthly = (df
+            .groupby(['course','period','subject','month'], as_index=False, observed=True)
             ['time_spent_hrs']
             .sum()
         )
-        
-        # For each period, generate the full list of weeks and left-merge
-        out = []
-        for period in weekly['period'].unique():
-            part = weekly[weekly['period'] == period].copy()
-            
-            # derive exact calendar bounds from daily data
-            days = df[df['period'] == period]
-            start, end = days['date'].min(), days['date'].max()
-            
-            # every Mon–Sun period covering [start, end]
-            full_weeks = pd.period_range(
-                start=start.to_period('W-SUN'),
-                end  =end.to_period('W-SUN'),
-                freq ='W-SUN'
-            )
-            full   = pd.DataFrame({'week': full_weeks})
-            
-            # left-merge and zero-fill
-            merged = (
-                full
-                .merge(part, on='week', how='left')
-                .assign(
-                    time_spent_hrs = lambda d: d['time_spent_hrs'].ffill(),
-                    course         = part['course'].iloc[0],
-                    period         = period,
-                    subject        = lambda d: d['subject'].ffill()
-                )
-            )
-            
-            # sequential numbering from week 1 → N
-            merged['week_number'] = range(1, len(merged) + 1)
-            
-            out.append(merged)
-        
-        result = pd.concat(out, ignore_index=True)
-        result['week'] = result['week'].astype(str)
-        log.debug(f"Produced {len(result)} weekly rows over {len(out)} periods")
-        return result
+        monthly['month'] = monthly['month'].astype(str)
+        return DtypePolicy.apply(monthly, "daily_to_monthly_clean", hours_dtype='float64')
 
 
 
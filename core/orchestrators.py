@@ -2,6 +2,7 @@ from datetime import datetime, timezone,  timedelta
 from data.sqlalchemy import DBManager
 from data.file_handler import *
 from core.charts import Charts
+from core.aggregation_cube import AggregationCube
 
 from utils.logger import LoggerSingleton
 log = LoggerSingleton().get_logger()
@@ -21,6 +22,7 @@ class StartSequence:
             return False
 
         else:
+            Orchestrators.ensure_rollups()
             Orchestrators.check_sp_sync()
         return True
 
@@ -32,20 +34,28 @@ class StartSequence:
             f'{ccourse} - {cperiod} '
             f'starting on {period_start}')
 
+        # Recorded first, so the daily rows and weeks built below start at the period start.
+        DBManager().insert_period_data(
+            course=ccourse,
+            period=cperiod,
+            start_date=datetime.strptime(period_start, '%d-%m-%Y').date(),
+            finished=False
+        )
+
         importer = SPImportManager(
             path_str=str(SP_FILE), 
         )
-        tasks, projects = importer.get_sp_data()
-        flat_tasks = importer.clean_sp_tasks(
+        fingerprint = importer.get_file_fingerprint()
+        sync_headers, tasks, projects = importer.scan_sp_file()
+        tasks = importer.remove_child_tasks(tasks)
+        tasks_dfs = importer.iter_tasks_dfs(
             tasks=tasks,
             projects=projects, 
             ccourse=ccourse, 
             cperiod=cperiod
         )
-        df = importer.convert_tasks_to_df(flat_tasks, cstart=None)
-        Orchestrators.upsert_df_to_db(df)
-
-        sync_headers = importer.get_last_update_nums()
+        Orchestrators.upsert_tasks_dfs(tasks_dfs)
+        DBManager().upsert_records(table='sp_task_state', records=importer.iter_task_states(tasks))
 
         config_mng = JsonConfigManager()
         data={
@@ -55,6 +65,7 @@ class StartSequence:
                 "archive_young":sync_headers["archiveYoung"],
                 "archive_old":sync_headers["archiveOld"],
                 "update_date":str(datetime.now(timezone.utc)),
+                "fingerprint":fingerprint,
             },
             "current_period_data":{
                 "current_course":ccourse,
@@ -65,13 +76,6 @@ class StartSequence:
         config_mng.save_dict_to_config(data)
         log.debug(f"saving config:\n{data}")
 
-        DBManager().insert_period_data(
-            course=ccourse,
-            period=cperiod,
-            start_date=datetime.strptime(period_start, '%d-%m-%Y').date(),
-            finished=False
-        )
-
 class Orchestrators:        
     @staticmethod
     def plot_daily_hours_bars(*_, course:str=None, period:str=None):
@@ -81,8 +85,8 @@ class Orchestrators:
             period=config["current_period"]
 
         log.debug(f"Plotting daily data for {course}, {period}")
-        df = DBManager().get_daily_data(course, period)
-        Charts.plot_daily_stack_bar(df)
+        df_pivot = AggregationCube.get('day').select(course, period)
+        Charts.plot_daily_stack_bar(df_pivot)
 
     @staticmethod
     def insert_df_to_db(df, ccourse, cperiod, cstart):
@@ -93,8 +97,7 @@ class Orchestrators:
         daily_df = DFTransformers.basic_to_daily_clean(df, period_start)
         db.insert_daily_data(daily_df)
 
-        # weekly_df = DFTransformers.daily_to_weekly_clean(daily_df)
-        # db.insert_weekly_data(weekly_df)
+        Orchestrators.rebuild_rollups(db, {(ccourse, cperiod): pd.to_datetime(cstart, format='%d-%m-%Y')})
 
         db.insert_period_data(
             course=ccourse, 
@@ -108,13 +111,132 @@ class Orchestrators:
         db = DBManager()
         db.upsert_to_tables(table='main', df=df)
 
-        # period_start = {CURRENT_PERIOD:CURRENT_PERIOD_START}
+        changed_keys = set(zip(df['course'], df['period'], df['subject'], df['start_time']))
+        Orchestrators.update_daily_data(db, changed_keys)
+
+    @staticmethod
+    def upsert_tasks_dfs(tasks_dfs):
+        '''
+        Streams the rows of each main_data frame of `tasks_dfs` (e.g. from 
+        SPImportManager.iter_tasks_dfs()) into one main_data upsert, so that a single 
+        frame is held at a time, then recomputes the daily cells they touched.
+        '''
+        db = DBManager()
+        changed_keys = set()
+
+        def records():
+            for df in tasks_dfs:
+                changed_keys.update(zip(df['course'], df['period'], df['subject'], df['start_time']))
+                for row in df.itertuples(index=False, name=None):
+                    yield dict(zip(df.columns, row))
+
+        db.upsert_records(table='main', records=records())
+        Orchestrators.update_daily_data(db, changed_keys)
+
+    @staticmethod
+    def update_daily_data(db: DBManager, changed_keys: set):
+        '''
+        Recomputes only the daily cells of the changed (course, period, subject, day) keys, 
+        and the weeks and months that hold them.
+        '''
+        if not changed_keys:
+            return
+
+        keys = pd.DataFrame(list(changed_keys), columns=['course', 'period', 'subject', 'day'])
+        spans = (keys
+            .assign(day=pd.to_datetime(keys['day']).dt.normalize())
+            .groupby(['course', 'period'])['day'].agg(['min', 'max'])
+        )
+
+        # Daily totals are summed from main_data rather than from the synced rows, so that 
+        # tasks not present in them (e.g. skipped archive sections) still count on those days.
+        main_dfs = []
+        first_days, last_days = {}, {}
+        for (course, period), span in spans.iterrows():
+            main_dfs.append(db.get_main_data(
+                course=course, period=period, 
+                start_from=span['min'], end_before=span['max'] + pd.Timedelta(days=1)
+            ))
+            # Days added after a gap also change the (empty) weeks in between.
+            last_day = db.get_last_day(course, period)
+            first_days[(course, period)] = span['min'] if last_day is None else min(span['min'], last_day)
+            last_days[(course, period)] = span['max']
+
+        delta = DFTransformers.daily_delta(pd.concat(main_dfs, ignore_index=True), changed_keys)
+        log.debug(f"Daily delta of {len(delta)} rows.")
+        db.apply_daily_delta(delta)
+
+        Orchestrators.rebuild_rollups(db, first_days, last_days)
 
-        daily_df = DFTransformers.basic_to_daily_clean(df)
-        db.upsert_to_tables(table='daily', df=daily_df)
+    @staticmethod
+    def rebuild_rollups(db: DBManager, first_days: dict, last_days: dict | None = None):
+        '''
+        Recomputes the weekly and monthly rows of each (course, period) in `first_days`, 
+        only for the weeks and months from its first day to its day in `last_days` 
+        (or to its end).
+        '''
+        if not first_days:
+            return
+        last_days = last_days or {}
 
-        # weekly_df = DFTransformers.daily_to_weekly_clean(daily_df)
-        # db.upsert_to_tables(table='weekly', df=weekly_df)
+        period_starts = db.get_period_starts()
+        periods_first_day = {
+            key: min(first_day, period_starts.get(key, first_day))
+            for key, first_day in db.get_first_days().items()
+        }
+        weekly_dfs, monthly_dfs, windows = [], [], []
+        for (course, period), first_day in first_days.items():
+            # Whole weeks and months are re-read, so their totals include the untouched days.
+            first_day = pd.Timestamp(first_day).normalize()
+            week_start = first_day - pd.Timedelta(days=first_day.dayofweek)
+            month_start = first_day.replace(day=1)
+
+            week_end = month_end = None
+            if last_days.get((course, period)) is not None:
+                last_day = pd.Timestamp(last_days[(course, period)]).normalize()
+                week_end = last_day + pd.Timedelta(days=6 - last_day.dayofweek)
+                month_end = last_day + pd.offsets.MonthEnd(0)
+
+            daily_df = db.get_daily_data(
+                course=course, period=period, 
+                start_date=min(week_start, month_start), 
+                end_date=None if week_end is None else max(week_end, month_end),
+                hours_dtype="float64"
+            )
+            weeks_df = daily_df[(daily_df['date'] >= week_start) & (week_end is None or daily_df['date'] <= week_end)]
+            months_df = daily_df[(daily_df['date'] >= month_start) & (month_end is None or daily_df['date'] <= month_end)]
+
+            # The rows of the whole windows are replaced, so that weeks and months that lost 
+            # all their hours (not in daily_df any more) are cleared too.
+            windows.append((
+                course, period,
+                str(week_start.to_period('W-SUN')), None if week_end is None else str(week_end.to_period('W-SUN')),
+                month_start.strftime('%Y-%m'), None if month_end is None else month_end.strftime('%Y-%m'),
+            ))
+            if weeks_df.empty:
+                continue
+
+            period_start = {period: periods_first_day.get((course, period), daily_df['date'].min())}
+            period_subjects = {period: db.get_subject_totals(course, period)['subject']}
+            weekly_dfs.append(DFTransformers.daily_to_weekly_clean(weeks_df, period_start, period_subjects))
+            monthly_dfs.append(DFTransformers.daily_to_monthly_clean(months_df))
+
+        db.replace_rollups(
+            weekly_df=pd.concat(weekly_dfs, ignore_index=True) if weekly_dfs else pd.DataFrame(),
+            monthly_df=pd.concat(monthly_dfs, ignore_index=True) if monthly_dfs else pd.DataFrame(),
+            windows=windows
+        )
+
+    @staticmethod
+    def ensure_rollups():
+        '''
+        Builds the weekly/monthly rollups from the whole daily_data when they are missing 
+        (new or migrated database).
+        '''
+        db = DBManager()
+        if db.is_empty('weekly') and not db.is_empty('daily'):
+            log.info("Building weekly and monthly rollups.")
+            Orchestrators.rebuild_rollups(db, db.get_first_days())
 
     @staticmethod
     def check_sp_sync():
@@ -124,44 +246,85 @@ class Orchestrators:
         sync_config = config["sync_data"]
         
         importer = SPImportManager(sync_config["sync_file_path"])
-        sync_headers = importer.get_last_update_nums()
+
+        # A file untouched since the last check is not even opened for parsing.
+        fingerprint = importer.get_file_fingerprint()
+        if fingerprint == sync_config.get("fingerprint"):
+            log.info(f"Sync file unchanged, no update required.")
+            return
+        sync_config["fingerprint"] = fingerprint
+
+        last_update = sync_config.get("last_update", 0)
+
+        # Cheap mmap probe first, so an unchanged file is never streamed.
+        probed_headers = importer.probe_sync_headers()
+        if probed_headers is not None and (probed_headers["lastUpdate"] or 0) <= last_update:
+            log.debug(f"sync headers = {probed_headers}")
+            log.info(f"No update required.")
+            config_mng.json_upsert({"sync_data": sync_config})
+            return
+
+        local_young = int(sync_config.get("archive_young", 0))
+        local_old   = int(sync_config.get("archive_old", 0))
+
+        # Headers are read before any entity; the scan stops there when the file has 
+        # not changed since the last sync, and skips the archives whose revision matches.
+        # Tasks are not filtered by date, so that the diff also sees edits and deletions of 
+        # days before the last sync.
+        sync_headers, tasks, projects = importer.scan_sp_file(
+            last_update=last_update,
+            archive_revs={"archiveYoung": local_young, "archiveOld": local_old},
+            sync_headers=probed_headers,
+            probe=False
+        )
         log.debug(f"sync headers = {sync_headers}")
 
-        update_needed = (sync_headers["lastUpdate"] > sync_config.get("last_update",0))
+        update_needed = (
+            tasks is not None 
+            and (sync_headers["lastUpdate"] or 0) > last_update
+        )
 
         if not update_needed:
             log.info(f"No update required.")
+            config_mng.json_upsert({"sync_data": sync_config})
             return
         
         log.info(f"Update required. Checking archived tasks.")
-        
-        local_young = int(sync_config.get("archive_young", 0))
-        local_old   = int(sync_config.get("archive_old", 0))
 
-        if local_young < sync_headers["archiveYoung"]:
+        if local_young != sync_headers["archiveYoung"]:
             log.info(f"Update of young archive required ({local_young} vs {sync_headers["archiveYoung"]})")
-        if local_old < sync_headers["archiveOld"]:
+        if local_old != sync_headers["archiveOld"]:
             log.info(f"Update of old archive required ({local_old} vs {sync_headers["archiveOld"]})")
         
-        last_sync_date = datetime.fromtimestamp(sync_config["last_update"]/1000, tz=timezone.utc).date()
-        log.info(f"Updating to latest SP data with active tasks after {last_sync_date}.")
-        tasks, projects = importer.get_sp_data(filter_date=last_sync_date)
-        log.info(f"Found {len(tasks)} tasks to update.")
+        log.info(f"Updating to latest SP data.")
+        log.info(f"Found {len(tasks)} tasks to check.")
+
+        # Subtasks are dropped first, as the diff may leave out their unchanged parent.
+        db = DBManager()
+        tasks, task_states = importer.diff_tasks(
+            tasks=importer.remove_child_tasks(tasks), 
+            known_states=db.get_sp_task_states()
+        )
+        log.info(f"{len(tasks)} of them changed since last sync.")
 
+        # No date filter here: the diff already kept only the changed days, including 
+        # corrections of days before the last sync.
         ccourse_config=config["current_period_data"]
-        flat_tasks = importer.clean_sp_tasks(
+        tasks_dfs = importer.iter_tasks_dfs(
             tasks=tasks, projects=projects, 
             ccourse=ccourse_config["current_course"], 
-            cperiod=ccourse_config["current_period"], 
-            filter_date=last_sync_date
+            cperiod=ccourse_config["current_period"]
         )
-        df = importer.convert_tasks_to_df(flat_tasks, cstart=None)
-        Orchestrators.upsert_df_to_db(df)
+        Orchestrators.upsert_tasks_dfs(tasks_dfs)
+        db.upsert_records(table='sp_task_state', records=task_states.values())
 
-        JsonConfigManager().json_upsert({
+        sync_config.update({
             "last_update":sync_headers["lastUpdate"],
+            "archive_young":sync_headers["archiveYoung"],
+            "archive_old":sync_headers["archiveOld"],
             "update_date":str(datetime.now(timezone.utc))
         })
+        config_mng.json_upsert({"sync_data": sync_config})
 
     @staticmethod
     def get_basic_stats(*_) -> dict:
@@ -169,13 +332,13 @@ class Orchestrators:
         config = JsonConfigManager().load_json_config()["sync_data"]
         last_dt_sync = datetime.fromisoformat(config['update_date'])
 
-        df = DBManager().get_daily_data()
-        last_db_day = df['date'].max()
-        total_hours_last_day = df.loc[df['date'] == last_db_day, 'time_spent_hrs'].sum()
+        db = DBManager()
+        last_db_day = db.get_last_day()
+        total_hours_last_day = 0.0 if last_db_day is None else db.get_day_hours(last_db_day)
 
         return {
             "last_sync":last_dt_sync.date(),
-            "last_db_day": last_db_day.date(),
+            "last_db_day": None if last_db_day is None else last_db_day.date(),
             "last_db_hrs":total_hours_last_day
         }
         
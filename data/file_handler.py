@@ -1,82 +1,368 @@
-import json, re, os
+import json, re, os, mmap, hashlib
 import ijson
 import warnings
-from ijson.common import ObjectBuilder
 from pathlib import Path
+from itertools import islice
 import pandas as pd
+import numpy as np
 from core.data_transformers import DFTransformers
+from utils.dtype_policy import DtypePolicy
 from enum import Enum
 from datetime import datetime, timezone,  timedelta, date
 
 from utils.logger import LoggerSingleton
 log = LoggerSingleton().get_logger()
 
+HEADER_PROBE_WINDOW = 256 * 1024 # bytes searched at each end of the sync file
+FINGERPRINT_BLOCK   = 64 * 1024  # bytes hashed at each end of the sync file
+SP_TASK_BATCH       = 500        # tasks flattened per frame by iter_tasks_dfs()
+
+def select_ijson_backend(preferred: str = "yajl2_c"):
+    """
+    Returns the preferred ijson backend (the C one by default) if it is installed,
+    or ijson's own default backend otherwise.
+    """
+    try:
+        backend = ijson.get_backend(preferred)
+    except ImportError:
+        log.warning(f"ijson backend '{preferred}' not available, using '{ijson.backend_name}'.")
+        backend = ijson
+    return backend
+
+IJSON_BACKEND = select_ijson_backend()
+
+# ijson prefixes of the entity maps used from the SuperProductivity dump
+SP_TASK_PREFIXES = {
+    "task":         "mainModelData.task.entities",
+    "archiveYoung": "mainModelData.archiveYoung.task.entities",
+    "archiveOld":   "mainModelData.archiveOld.task.entities",
+}
+SP_PROJECT_PREFIX = "mainModelData.project.entities"
+
+# entity keys actually used downstream (build_tasks_df)
+SP_TASK_FIELDS    = ("title", "projectId", "subTaskIds", "timeSpentOnDay", "isDone")
+SP_PROJECT_FIELDS = ("title",)
+
+def seek_json_start(f, chunk_size:int=64):
+    """
+    Reads the binary file `f` in small chunks of 64 bytes until "{" character is seen,
+    indicating json start, and leaves the file positioned on it.
+    """
+    header_buf = b""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError("No JSON start found!")
+        
+        header_buf += chunk     # append these bytes to our buffer
+        
+        idx = header_buf.find(b"{")
+        # If it returns -1, there’s no { yet, so we loop again and read another 64 bytes.
+        if idx != -1: 
+            # Indicates the first '{' at position idx within header_buf
+            f.seek(- (len(header_buf) - idx), 1)
+            return f
+
 def stream_json_file(file_path: Path, chunk_size:int=64, limit=None):
     """
     A generator over (prefix, event, value) for every JSON token
     in the SuperProductivity json dump.
-    Reads in small chunks of 64 bits until "{" character is seen,
-    indicating json start(?).
-
     """
     with open(file_path, "rb") as f:
-        header_buf = b""
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                raise ValueError("No JSON start found!")
-            
-            header_buf += chunk     # append these bytes to our buffer
-            
-            idx = header_buf.find(b"{")
-            # If it returns -1, there’s no { yet, so we loop again and read another 64 bytes.
-            if idx != -1: 
-                # Indicates the first '{' at position idx within header_buf
-                f.seek(- (len(header_buf) - idx), 1)
-                break
+        seek_json_start(f, chunk_size)
 
         count = 0
-        for prefix, event, value in ijson.parse(f):
+        for prefix, event, value in IJSON_BACKEND.parse(f):
             yield prefix, event, value
             
             count += 1
             if limit and count >= limit:
                 break                 
 
+def collect_sync_headers(events, headers: dict):
+    """
+    Passes the (prefix, event, value) `events` through, storing the sync headers
+    ("lastUpdate" and the "revMap" archive revisions) in `headers` as they go by.
+    """
+    wanted = {
+        "lastUpdate":           "lastUpdate",
+        "revMap.archiveYoung":  "archiveYoung",
+        "revMap.archiveOld":    "archiveOld",
+    }
+    e_types = ("number", "string", "null")
+
+    for prefix, event, value in events:
+        if prefix in wanted and event in e_types:
+            headers[wanted[prefix]] = value
+        yield prefix, event, value
+
+def probe_top_level_value(buf, key: str, json_start: int, window: int = HEADER_PROBE_WINDOW):
+    """
+    Byte-level lookup of a top-level key of the json blob in `buf` (bytes or mmap).
+    Only the first and last `window` bytes are searched, so the cost is bounded 
+    whatever the size of the file.
+
+    A hit is only accepted when it can be proven to be at the top level of the blob:
+        - head: everything from the json start up to the key is a complete object prefix.
+        - tail: everything from the key up to EOF closes the top-level object.
+
+    Returns the decoded value, or None if the key is not found, is found more than once
+    or cannot be proven to be at the top level (ambiguous probe).
+    """
+    needle = b'"' + key.encode() + b'":'
+    size = len(buf)
+    head_end = min(size, json_start + window)
+    tail_start = max(head_end, size - window)
+
+    def is_top_level(pos: int) -> bool:
+        if pos < head_end:
+            prefix = buf[json_start:pos].rstrip()
+            if prefix.endswith(b","): 
+                prefix = prefix[:-1]
+            try:
+                json.loads(prefix + b"}")
+                return True
+            except ValueError:
+                pass
+        if size - pos <= window:
+            try:
+                json.loads(b"{" + buf[pos:size])
+                return True
+            except ValueError:
+                pass
+        return False
+
+    hits = []
+    for lo, hi in ((json_start, head_end), (tail_start, size)):
+        pos = buf.find(needle, lo, hi)
+        while pos != -1:
+            if is_top_level(pos): 
+                hits.append(pos)
+            pos = buf.find(needle, pos + 1, hi)
+
+    if len(hits) != 1:
+        return None
+
+    value_start = hits[0] + len(needle)
+    value_end = head_end if value_start < head_end else size
+    try:
+        raw = buf[value_start:value_end].decode("utf-8", errors="ignore").lstrip()
+        value, _ = json.JSONDecoder().raw_decode(raw)
+    except ValueError:
+        return None
+    return value
+
+def task_digest(task: dict, time_spent_on_day: dict) -> str:
+    """
+    Compact digest of the fields of an SP task that end up in main_data.
+    """
+    payload = json.dumps(
+        [task.get("title"), task.get("projectId"), task.get("isDone"), sorted(time_spent_on_day.items())],
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.blake2b(payload.encode(), digest_size=8).hexdigest()
+
+def project_entities(entities: dict, fields: tuple[str, ...] | None) -> dict:
+    """
+    Keeps only `fields` (and their nested subtrees) of each entity, or everything if None.
+    """
+    if fields is None:
+        return entities
+    return {
+        entity_id: {key: entity[key] for key in fields if key in entity}
+        for entity_id, entity in entities.items()
+    }
+
+class TaskHierarchy:
+    '''
+    Parent/child index of SP tasks, built once per import from their "subTaskIds".
+    Only relations between tasks present in `tasks` are indexed.
+    '''
+    def __init__(self, tasks: dict[str, dict]):
+        self.children: dict[str, list[str]] = {
+            task_id: task["subTaskIds"]
+            for task_id, task in tasks.items()
+            if task.get("subTaskIds")
+        }
+        self.parent: dict[str, str] = {
+            subtask_id: task_id
+            for task_id, subtask_ids in self.children.items()
+            for subtask_id in subtask_ids
+        }
+
+    def is_subtask(self, task_id: str) -> bool:
+        return task_id in self.parent
+
+    def root(self, task_id: str) -> str:
+        seen = {task_id}
+        while task_id in self.parent and self.parent[task_id] not in seen:
+            task_id = self.parent[task_id]
+            seen.add(task_id)
+        return task_id
+
+    def top_level(self, tasks: dict[str, dict]) -> dict[str, dict]:
+        '''
+        Tasks that are not the subtask of another task, whatever their order in `tasks`.
+        '''
+        return {
+            task_id: task for task_id, task in tasks.items()
+            if task_id not in self.parent
+        }
+
+class FlatTaskColumns:
+    '''
+    Columnar accumulator of the flattened (task, day) rows of SP tasks.
+
+    Rows are appended per task into plain lists of day keys, ms spent and category codes,
+    and converted once to typed arrays in to_df(): datetime64 days, float64 hours,
+    categoricals for course/period/subject and bool for finished.
+    '''
+    def __init__(self, ccourse: str, cperiod: str):
+        self.ccourse = ccourse
+        self.cperiod = cperiod
+        self.days = []
+        self.ms_spent = []
+        self.subject_codes = []
+        self.task_names = []
+        self.finished = []
+        self.subjects = {}  # subject title -> category code
+
+    def add_task(self, task_dict: dict, subject: str, filter_day: str | None = None,
+                 time_spent_on_day: dict | None = None):
+        '''
+        `time_spent_on_day` overrides the task's own times, e.g. to book a subtask's 
+        time under its parent.
+        '''
+        if time_spent_on_day is None:
+            time_spent_on_day = task_dict["timeSpentOnDay"]
+        if filter_day is not None:
+            time_spent_on_day = {
+                day: spent for day, spent in time_spent_on_day.items() 
+                if day >= filter_day
+            }
+
+        n = len(time_spent_on_day)
+        if n == 0:
+            return
+
+        code = self.subjects.setdefault(subject, len(self.subjects))
+
+        self.days.extend(time_spent_on_day.keys())
+        self.ms_spent.extend(time_spent_on_day.values())
+        self.subject_codes.extend([code] * n)
+        self.task_names.extend([task_dict["title"].strip()] * n)
+        self.finished.extend([task_dict.get("isDone", False)] * n)
+
+    def to_df(self) -> pd.DataFrame:
+        n = len(self.days)
+        start_time = np.array(self.days, dtype="datetime64[D]").astype("datetime64[ns]")
+        ms_spent = np.array(self.ms_spent, dtype=np.float64)
+        hours = ms_spent / 3_600_000
+
+        df = pd.DataFrame({
+            'course':   pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [self.ccourse]),
+            'period':   pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [self.cperiod]),
+            'subject':  pd.Categorical.from_codes(
+                            np.array(self.subject_codes, dtype=np.int32), list(self.subjects)),
+            'task_name': self.task_names,
+            'start_time': start_time, # Due to SP data structure, tasks start 00:00
+            'end_time': start_time + np.rint(ms_spent).astype("timedelta64[ms]"),
+            'time_spent_hrs': hours,
+            'finished': np.array(self.finished, dtype=bool),
+        })
+        return DtypePolicy.apply(df, "build_tasks_df", hours_dtype="float64")
+
 class SPImportManager:
-    def __init__(self, path_str: str):
+    def __init__(self, path_str: str, 
+            task_fields: tuple[str, ...] | None = SP_TASK_FIELDS, 
+            project_fields: tuple[str, ...] | None = SP_PROJECT_FIELDS
+        ):
+        '''
+        task_fields / project_fields: projection applied to the entities as each section
+            is parsed, dropping every other key and its nested subtree (attachments, notes,
+            reminders, repeat config...). None keeps the full objects.
+        '''
         sp_path = Path(path_str)
         if not sp_path.exists():
             log.error(f'Error, sync path does not exist ({path_str})')
         self.sp_path     = sp_path
+        self.backend     = IJSON_BACKEND
+        self.fields      = {name: task_fields for name in SP_TASK_PREFIXES}
+        self.fields["project"] = project_fields
     
-    def get_last_update_nums(self) -> dict:
-        lastUpdate = None 
-        archiveYoung = None
-        archiveOld = None
-        e_types = ["number", "string", "null"]
-
-        for prefix, event, value in stream_json_file(file_path=self.sp_path):
-            parts = prefix.split(".")
-
-            if (parts[0] == "lastUpdate" and event in e_types):
-                lastUpdate = value
-            elif (parts[:2] == ["revMap","archiveYoung"] and event in e_types):
-                archiveYoung = value
-            elif (parts[:2] == ["revMap","archiveOld"] and event in e_types):
-                archiveOld = value
-
-            if (lastUpdate is not None and
-                archiveYoung is not None and
-                archiveOld is not None):
-                break
-        
+    def get_file_fingerprint(self, block_size: int = FINGERPRINT_BLOCK) -> dict:
+        '''
+        Cheap fingerprint of the sync file: size, mtime_ns and a hash of its first
+        and last blocks. Equal fingerprints mean the file has not been touched.
+        '''
+        stat = self.sp_path.stat()
+        digest = hashlib.blake2b(digest_size=16)
+
+        with open(self.sp_path, "rb") as f:
+            digest.update(f.read(block_size))
+            if stat.st_size > block_size:
+                f.seek(max(block_size, stat.st_size - block_size))
+                digest.update(f.read(block_size))
+
         return {
-            "lastUpdate":   lastUpdate,
-            "archiveYoung": int(archiveYoung),
-            "archiveOld":   int(archiveOld)
+            "size":     stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "edges_hash": digest.hexdigest(),
         }
 
+    def get_last_update_nums(self) -> dict:
+        sync_headers = self.probe_sync_headers()
+        if sync_headers is None:
+            sync_headers = self.scan_sync_headers()
+        return sync_headers
+
+    def probe_sync_headers(self, window: int = HEADER_PROBE_WINDOW) -> dict | None:
+        '''
+        Fast header probe: memory-maps the sync file and reads "lastUpdate" and
+        "revMap" with a bounded byte search (see probe_top_level_value()).
+
+        Returns the same dict as get_last_update_nums(), or None when the probe is
+        ambiguous and the ijson scan has to be used instead.
+        '''
+        try:
+            with open(self.sp_path, "rb") as f, \
+                 mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                json_start = mm.find(b"{", 0, window)
+                if json_start == -1:
+                    return None
+                last_update = probe_top_level_value(mm, "lastUpdate", json_start, window)
+                rev_map     = probe_top_level_value(mm, "revMap", json_start, window)
+        except (OSError, ValueError) as e:
+            log.warning(f"Header probe failed on {self.sp_path}: {e}")
+            return None
+
+        if (not isinstance(last_update, int)
+            or not isinstance(rev_map, dict)
+            or "archiveYoung" not in rev_map
+            or "archiveOld" not in rev_map):
+            log.debug("Header probe ambiguous, falling back to ijson scan.")
+            return None
+
+        return self._format_sync_headers({
+            "lastUpdate":   last_update,
+            "archiveYoung": rev_map["archiveYoung"],
+            "archiveOld":   rev_map["archiveOld"],
+        })
+
+    def scan_sync_headers(self) -> dict:
+        '''
+        ijson fallback of probe_sync_headers(): streams the file until the three
+        headers are found.
+        '''
+        headers = {"lastUpdate": None, "archiveYoung": None, "archiveOld": None}
+
+        for _ in collect_sync_headers(stream_json_file(file_path=self.sp_path), headers):
+            if None not in headers.values():
+                break
+
+        return self._format_sync_headers(headers)
+
     def get_sp_data(self, filter_date: date = None):
         '''
         Retrieve and parse SuperProductivity JSON data, optionally filtering tasks by date of time entries.
@@ -92,7 +378,8 @@ class SPImportManager:
                 - projects: A mapping from project IDs to project objects (unfiltered).
 
         Behavior:
-            - Streams the JSON blob with ijson, building one task/project at a time.
+            - Streams the JSON blob once with ijson, building only the known entity
+              sections (SP_TASK_PREFIXES, SP_PROJECT_PREFIX) in the ijson backend.
             - Tracks the maximum day seen in each task's "timeSpentOnDay" map.
             - Filters out tasks whose max day < `filter_date` (if filtering is enabled).
             - Optionally updates the configuration's "last_update" to the highest date seen
@@ -121,193 +408,306 @@ class SPImportManager:
                     "dueDay": "2025-06-24"
                 },
             }]
-        '''     
+        '''
+        _, tasks, projects = self.scan_sp_file(filter_date=filter_date)
 
-        if filter_date is not None:
-            cutoff: date = filter_date 
-        else:
-            cutoff = None
+        # DEBUG PURPOSES
+        # JsonConfigManager(Path('raw_tasks.json')).save_dict_to_config(data=tasks)
+
+        return tasks, projects
+
+    def scan_sp_file(self, 
+            filter_date: date = None, 
+            last_update: int | None = None,
+            archive_revs: dict | None = None,
+            sync_headers: dict | None = None,
+            probe: bool = True
+        ) -> tuple[dict, dict | None, dict | None]:
+        '''
+        Reads the sync headers ("lastUpdate" and the "revMap" archive revisions) and, 
+        if needed, the task/project entities of the sync file.
 
-        max_day_seen = date.min
+        Parameters:
+            filter_date: same as in get_sp_data().
+            last_update: "lastUpdate" stored on the last sync. If the file's "lastUpdate"
+                is not newer, the scan stops at the headers and no entity is parsed.
+            archive_revs: {"archiveYoung": rev, "archiveOld": rev} stored on the last sync.
+                Archive sections whose "revMap" revision still matches are not parsed.
+            sync_headers: headers already read by the caller (e.g. with probe_sync_headers()).
+            probe: if no `sync_headers` are given, try probe_sync_headers() first. When the 
+                headers are still unknown, they are collected in the same pass as the entities.
+
+        Returns:
+            tuple[dict, dict | None, dict | None]: (sync_headers, tasks, projects).
+                tasks and projects are None when the scan stopped at the headers.
+        '''
+        headers = sync_headers
+        if headers is None and probe:
+            headers = self.probe_sync_headers()
+
+        log.debug(f"Parsing sync file with ijson backend '{self.backend.backend_name}'.")
 
         tasks = {}
         projects = {}
-        
-        task_builder = None
-        proj_builder = None
-        current_task = None
-        current_proj = None        
-
-        for prefix, event, value in stream_json_file(file_path=self.sp_path):
-            parts = prefix.split(".")
-            lparts = len(parts)
-
-            # --------------- PROJECTS --------------- #
-            if (
-                event == "start_map"
-                and lparts == 4
-                and parts[:3] == ["mainModelData", "project", "entities"]
-                and parts[3] != "INBOX_PROJECT"
-            ):
-                current_proj = parts[lparts-1]
-                proj_builder = ObjectBuilder()
-                proj_builder.event(event, value)
+        sections = {**SP_TASK_PREFIXES, "project": SP_PROJECT_PREFIX}
+        archive_revs = archive_revs or {}
+
+        if headers is None:
+            # Unknown headers are read in the same pass, so the checks below are done on
+            # each section as it arrives, and once more at the end for headers written last.
+            headers = {"lastUpdate": None, "archiveYoung": None, "archiveOld": None}
+            parsed_sections = self.iter_sections(sections, headers=headers)
+        else:
+            if self._is_unchanged(headers, last_update):
+                return headers, None, None
+
+            for archive, rev in archive_revs.items():
+                if self._is_unchanged_archive(headers, archive, rev):
+                    sections.pop(archive)
+
+            parsed_sections = self.iter_sections(sections)
+
+        sections_tasks = {}
+        for section, entities in parsed_sections:
+            if self._is_unchanged(headers, last_update):
+                return self._format_sync_headers(headers), None, None
+            if section in archive_revs and self._is_unchanged_archive(headers, section, archive_revs[section]):
                 continue
 
-            # B) If we’re inside a project, feed every event
-            if proj_builder is not None:
-                proj_builder.event(event, value)
-
-                # C) On the matching end_map, finalize
-                if (
-                    event == "end_map"
-                    and len(parts) == 4
-                    and parts[:3] == ["mainModelData", "project", "entities"]
-                ):
-                    proj = proj_builder.value
-                    # prune the unwanted nested keys:
-                    proj.pop("advancedCfg", None)
-                    proj.pop("theme",       None)
-                    proj.pop("icon", None)
-
-                    projects[current_proj] = proj
-
-                    # Reset
-                    proj_builder = None
-                    current_proj = None
-
-                    # Don’t fall through into task logic
-                    continue
+            if section == "project":
+                projects = self.clean_projects(entities)
+                continue
 
+            section_tasks = self.filter_tasks(entities, filter_date=filter_date)
+            log.debug(f"Parsed {len(section_tasks)}/{len(entities)} tasks from '{section}'.")
+            sections_tasks[section] = section_tasks
 
-            # --------------- Current Tasks --------------- #
-            # Detect start of a task object
-            # mainModelData.archiveYoung.task.entities.id
-            # mainModelData.archiveOld.task.entities.id
-            # mainModelData.task.entities.NCEaP5ZYh4lVVPUsy1BLG
-            if (
-                event == "start_map"
-                and lparts >= 4
-                and parts[lparts-3:lparts-1] == ["task", "entities"]
-            ):
-                
-                current_task = parts[lparts-1]
-                
-                task_builder = ObjectBuilder()
-                task_builder.event(event, value)
-
-                if filter_date is not None:
-                    # we're filtering: start each task with the oldest possible day
-                    max_day_seen = date.min
-                else:
-                    # not filtering: it doesn’t matter, but set it so comparisons never fail
-                    max_day_seen = date.min
-                    
+        if self._is_unchanged(headers, last_update):
+            return self._format_sync_headers(headers), None, None
+        for section, section_tasks in sections_tasks.items():
+            if section in archive_revs and self._is_unchanged_archive(headers, section, archive_revs[section]):
                 continue
+            tasks.update(section_tasks)
 
-            if task_builder is not None:
-                
-                if (
-                    cutoff is not None 
-                    and prefix.endswith(".timeSpentOnDay") 
-                    and event == "map_key"
-                ):
-                    day = datetime.fromisoformat(value).date()
-
-                    if max_day_seen == None or day > max_day_seen:
-                        max_day_seen = day
-                                    
-                task_builder.event(event, value)
-
-                if (
-                    event == "end_map"
-                    and lparts >= 4 
-                    and parts[lparts-3:lparts-1] == ["task", "entities"]
-                ):
-
-                    if cutoff is None or max_day_seen >= cutoff:
-                        tasks[current_task] = task_builder.value
-                    
-                    # reset for next task
-                    task_builder = None
-                    current_task = None
-                    max_day_seen = None
+        return self._format_sync_headers(headers), tasks, projects
 
-        # DEBUG PURPOSES
-        # JsonConfigManager(Path('raw_tasks.json')).save_dict_to_config(data=tasks)
+    @staticmethod
+    def _is_unchanged(headers: dict, last_update: int | None) -> bool:
+        if (last_update is not None 
+            and headers["lastUpdate"] is not None 
+            and headers["lastUpdate"] <= last_update):
+            log.debug(f"lastUpdate unchanged ({headers['lastUpdate']}), stopping scan.")
+            return True
+        return False
 
-        return tasks, projects
+    @staticmethod
+    def _is_unchanged_archive(headers: dict, archive: str, rev) -> bool:
+        if rev is not None and headers[archive] is not None and int(rev) == int(headers[archive]):
+            log.debug(f"Skipping '{archive}', revision unchanged ({rev}).")
+            return True
+        return False
+
+    def iter_sections(self, sections: dict[str, str], headers: dict | None = None):
+        '''
+        Single pass over the children of "mainModelData", yielding (name, entities) for
+        each of `sections` ({name: ijson prefix of an entities map}).
+        
+        Each child is built by the ijson backend itself (no per-event python code) and
+        projected to self.fields right away, so only one unprojected section is held at a
+        time. The pass stops as soon as every wanted section has been read.
+
+        headers: if given, the sync headers are also stored in it during the same pass
+            (see collect_sync_headers()). The events then go through python, so this is
+            only used when probe_sync_headers() could not read them.
+        '''
+        # "mainModelData.archiveOld.task.entities" -> {"archiveOld": [(name, ["task", "entities"])]}
+        routes = {}
+        for name, prefix in sections.items():
+            _, child, *path = prefix.split(".")
+            routes.setdefault(child, []).append((name, path))
+
+        with open(self.sp_path, "rb") as f:
+            seek_json_start(f)
+
+            source = f
+            if headers is not None:
+                source = collect_sync_headers(self.backend.parse(f), headers)
+
+            for child, value in self.backend.kvitems(source, "mainModelData"):
+                for name, path in routes.pop(child, ()):
+                    entities = value
+                    for key in path:
+                        entities = entities.get(key) or {}
+                    yield name, project_entities(entities, self.fields.get(name))
+
+                if not routes:
+                    break
+
+            # Headers written after mainModelData.
+            if headers is not None and None in headers.values():
+                for _ in source:
+                    if None not in headers.values():
+                        break
 
     @staticmethod
-    def clean_sp_tasks(tasks:dict, projects:dict, ccourse:str, cperiod:str, filter_date: date = None, cstart=None):
-        def remove_child_tasks(tasks: dict[str, dict]) -> dict[str, dict]:
-            ignore_subtask_id = []
-            parent_tasks = {}
+    def filter_tasks(tasks: dict, filter_date: date = None) -> dict:
+        '''
+        Drops the tasks whose latest "timeSpentOnDay" day is before `filter_date`.
+        '''
+        if filter_date is None:
+            return tasks
+        
+        # ISO days ("2025-06-22") sort the same as the dates they represent
+        cutoff = filter_date.isoformat()
+        return {
+            task_id: task
+            for task_id, task in tasks.items()
+            if max(task.get("timeSpentOnDay") or (), default="") >= cutoff
+        }
 
-            for task_id, task_dict in tasks.items():
+    @staticmethod
+    def clean_projects(projects: dict) -> dict:
+        # Unused keys are already dropped by the project_fields projection.
+        projects.pop("INBOX_PROJECT", None)
+        return projects
 
-                if task_id in ignore_subtask_id: continue
-                if len(task_dict["subTaskIds"]) > 0:
-                    for subtask_id in task_dict["subTaskIds"]:
-                        ignore_subtask_id.append(subtask_id)
-                
-                parent_tasks[task_id] = task_dict
+    @staticmethod
+    def _format_sync_headers(headers: dict) -> dict:
+        return {
+            "lastUpdate":   headers["lastUpdate"],
+            "archiveYoung": int(headers["archiveYoung"] or 0),
+            "archiveOld":   int(headers["archiveOld"] or 0)
+        }
 
-            return parent_tasks
+    @staticmethod
+    def remove_child_tasks(tasks: dict[str, dict], hierarchy: "TaskHierarchy | None" = None) -> dict[str, dict]:
+        hierarchy = hierarchy or TaskHierarchy(tasks)
+        return hierarchy.top_level(tasks)
 
-        tasks = remove_child_tasks(tasks)
+    @staticmethod
+    def diff_tasks(tasks: dict[str, dict], known_states: dict[str, dict]) -> tuple[dict, dict]:
+        '''
+        Per-task change detection against the state stored on the last sync
+        (see DBManager.get_sp_task_states()).
+
+        Returns:
+            tuple[dict, dict]:
+                - changed tasks, with "timeSpentOnDay" reduced to the days whose time
+                  changed (all days if the title, project or done flag changed). Days 
+                  deleted since the last sync are kept with 0 ms, so their time is cleared.
+                - new states of those tasks, to be stored once they are in the database.
+        '''
+        changed = {}
+        states = {}
+
+        for task_id, task in tasks.items():
+            days = task.get("timeSpentOnDay") or {}
+            digest = task_digest(task, days)
+            known = known_states.get(task_id)
+
+            if known is not None and known["digest"] == digest:
+                continue
+
+            states[task_id] = SPImportManager.task_state(task_id, days, digest)
+
+            if known is not None:
+                known_days = json.loads(known["time_spent_on_day"])
+                removed_days = {day: 0 for day in known_days if day not in days}
+                # same digest with the old days -> only times changed, not the task itself
+                if task_digest(task, known_days) == known["digest"]:
+                    days = {
+                        day: spent for day, spent in days.items()
+                        if known_days.get(day) != spent
+                    }
+                days = {**days, **removed_days}
+
+            changed[task_id] = {**task, "timeSpentOnDay": days}
+
+        log.debug(f"{len(changed)}/{len(tasks)} tasks changed since last sync.")
+        return changed, states
+
+    @staticmethod
+    def task_state(task_id: str, time_spent_on_day: dict, digest: str) -> dict:
+        return {
+            "task_id": task_id,
+            "digest": digest,
+            "time_spent_on_day": json.dumps(time_spent_on_day, default=str),
+        }
+
+    @staticmethod
+    def iter_task_states(tasks: dict[str, dict]):
+        '''
+        States of all `tasks`, as stored by diff_tasks(), generated one at a time. 
+        For full imports, where there is nothing to diff against.
+        '''
+        for task_id, task in tasks.items():
+            days = task.get("timeSpentOnDay") or {}
+            yield SPImportManager.task_state(task_id, days, task_digest(task, days))
+
+    @staticmethod
+    def build_tasks_df(tasks:dict, projects:dict, ccourse:str, cperiod:str, filter_date: date = None,
+                       rollup_subtasks: bool = False) -> pd.DataFrame:
+        '''
+        Flattened (task, day) rows of `tasks` in the main_data format, filled column-wise
+        through FlatTaskColumns: no list of row dicts and no date string round-trip.
+
+        rollup_subtasks: instead of dropping subtasks, add their time to their top-level
+            parent's (task, day) rows. Only for dumps where parents do not already hold
+            the time of their subtasks, else it is counted twice.
+            Library-only: the import and sync flows drop subtasks before calling this, as
+            check_sp_sync() diffs tasks one by one and would only roll up the changed
+            subtasks into a parent's rows.
+        '''
+        hierarchy = TaskHierarchy(tasks)
 
-        # map of project_id:project_title
         proj_titles = {
             pid: proj["title"].strip()
             for pid, proj in projects.items()
         }
-        
-        flat_tasks = []
-    
+        filter_day = filter_date.isoformat() if filter_date is not None else None
+
+        columns = FlatTaskColumns(ccourse, cperiod)
         for task_id, task_dict in tasks.items():
-            
-            proj_id = task_dict["projectId"] # fall back to pid if we don't know this project
-            subject_title = proj_titles.get(proj_id, proj_id)
+            owner = task_dict
+            if hierarchy.is_subtask(task_id):
+                if not rollup_subtasks:
+                    continue
+                owner = tasks[hierarchy.root(task_id)]
 
-            for time_day, time_spent in task_dict['timeSpentOnDay'].items():
-                day = datetime.fromisoformat(time_day).date()
+            proj_id = owner["projectId"] # fall back to pid if we don't know this project
+            columns.add_task(owner, proj_titles.get(proj_id, proj_id), filter_day,
+                             time_spent_on_day=task_dict["timeSpentOnDay"])
 
-                if filter_date is not None and day < filter_date: 
-                    continue
+        df = columns.to_df()
 
-                hours = time_spent / 3_600_000
+        if rollup_subtasks and hierarchy.parent:
+            keys = ['course', 'period', 'subject', 'task_name', 'start_time', 'finished']
+            df = df.groupby(keys, observed=True, sort=False, as_index=False)['time_spent_hrs'].sum()
+            df['end_time'] = df['start_time'] + pd.to_timedelta(np.rint(df['time_spent_hrs'] * 3_600_000), unit='ms')
+            df = df[['course', 'period', 'subject', 'task_name', 'start_time', 'end_time', 'time_spent_hrs', 'finished']]
 
-                day_start = day # Due to SP data structure, tasks start 00:00
-                end_start   = day_start + timedelta(hours=hours)
-                
-                flat_tasks.append({
-                    'course': ccourse,
-                    'period': cperiod,
-                    'subject': subject_title,
-                    'task_name': task_dict['title'].strip(),
-                    'start_time': day_start.isoformat(),
-                    'end_time': end_start.isoformat(),
-                    'time_spent_hrs': hours,
-                    'finished': task_dict.get("isDone", False),
-                })
-
-        log.debug(f"Generated a total of {len(flat_tasks)} tasks.")
-
-        return flat_tasks
-    
-    @staticmethod
-    def convert_tasks_to_df(tasks_list: list[dict], cstart=None) -> pd.DataFrame:
-        if cstart != None:
-            log.warning(f"Current start feature not yet added.")
-
-        df = pd.DataFrame(tasks_list)
-        df["start_time"] = pd.to_datetime(df["start_time"])
-        df["end_time"]   = pd.to_datetime(df["end_time"],
-                                format="ISO8601",
-                                errors="raise")
+        log.debug(f"Generated a total of {len(df)} tasks.")
         return df
 
+    @staticmethod
+    def iter_tasks_dfs(tasks:dict, projects:dict, ccourse:str, cperiod:str, filter_date: date = None,
+                       batch_size:int = SP_TASK_BATCH):
+        '''
+        build_tasks_df() over `batch_size` tasks at a time, so that only one batch of
+        flattened rows is held while they are streamed to the database 
+        (see Orchestrators.upsert_tasks_dfs()).
+        `tasks` must not hold subtasks (see remove_child_tasks()): a subtask whose parent
+        is in another batch would be flattened as a task of its own.
+        '''
+        task_ids = iter(tasks)
+        while batch := list(islice(task_ids, batch_size)):
+            df = SPImportManager.build_tasks_df(
+                tasks={task_id: tasks[task_id] for task_id in batch},
+                projects=projects, ccourse=ccourse, cperiod=cperiod, filter_date=filter_date
+            )
+            if not df.empty:
+                yield df
+
 class AbstractSpoonTDLImporter:
     '''
     Legacy code for importing Abstractspoon's todolist logs from courses of 2021 to 2024.
@@ -366,7 +766,7 @@ class AbstractSpoonTDLImporter:
             df_daily = DFTransformers.basic_to_daily_clean(df_basic=df_clean, periods_start=periods_start)
             DBManager.insert_daily_data(df_daily)
 
-            df_weekly = DFTransformers.basic_to_weekly_clean(df_daily=df_daily)
+            df_weekly = DFTransformers.daily_to_weekly_clean(df_daily=df_daily, periods_start=periods_start)
             DBManager.insert_weekly_data(df_weekly)
             
             log.info(f"Imported file {files.index(file)+1}/{len(files)}: {file} ")
@@ -1,28 +1,376 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, select, type_coerce, inspect, func, exists, bindparam
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from pathlib import Path
+from datetime import datetime
+from itertools import islice
+from threading import Lock
+from collections import OrderedDict
+from functools import wraps
+import copy
+import sys
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, Index, ForeignKey
 import pandas as pd
+import numpy as np
 
+from utils.dtype_policy import DtypePolicy, HOURS_DTYPE
 from utils.logger import LoggerSingleton
 log = LoggerSingleton().get_logger()
 
 Base = declarative_base()
 
+UPSERT_BATCH_SIZE = 5_000
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",      # readers (stats, charts) don't block on a sync writing
+    "synchronous": "NORMAL",    # safe with WAL, skips the fsync on every commit
+    "temp_store": "MEMORY",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,   # negative = KiB, i.e. 64 MiB of page cache
+}
+
+DAILY_READ_CHUNK = 50_000
+# Only non-zero (day, subject) rows are stored; get_daily_data() zero-fills the other days.
+DAILY_SPARSE = True
+# PRAGMA user_version from which daily_data is known to be sparse (compacted once).
+SPARSE_DAILY_VERSION = 1
+DAILY_COLUMNS = ("date", "course", "period", "subject", "time_spent_hrs")
+DAILY_DTYPES = {
+    "course": "str",
+    "period": "str",
+    "subject": "str",
+    "time_spent_hrs": "float64",
+}
+MAIN_COLUMNS = ("course", "period", "subject", "task_name", "start_time", "end_time", "time_spent_hrs", "finished")
+# Names are categoricals and days datetime64[s] in the frames read, see DtypePolicy.
+MAIN_DTYPES = {
+    "time_spent_hrs": "float64",
+    "finished": "bool",
+}
+SQLITE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"   # as stored by sqlalchemy's DateTime
+
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Record column -> id column of the fact tables (main, daily, weekly).
+DIM_KEYS = {
+    "course": "course_id",
+    "period": "period_id",
+    "subject": "subject_id",
+    "task_name": "task_id",
+}
+
+class EngineRegistry:
+    '''
+    Process-wide registry of one engine (and its connection pool) per database url,
+    so DBManager() instances are cheap and share pooled connections.
+    '''
+    _engines = {}
+    _lock = Lock()
+
+    @classmethod
+    def get_engine(cls, url:str):
+        engine = cls._engines.get(url)
+        if engine is None:
+            with cls._lock:
+                engine = cls._engines.get(url)
+                if engine is None:  # double-checked locking
+                    log.debug(f"Creating engine for {url}")
+                    engine = create_engine(url, echo=False)
+                    event.listen(engine, "connect", cls._set_sqlite_pragmas)
+                    cls._engines[url] = engine
+        return engine
+
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {pragma}={value}")
+        finally:
+            cursor.close()
+
+    @classmethod
+    def dispose_all(cls):
+        with cls._lock:
+            for engine in cls._engines.values():
+                engine.dispose()
+            cls._engines.clear()
+
+class QueryCache:
+    '''
+    Process-wide LRU cache of DBManager read results, capped at QUERY_CACHE_MAX_BYTES.
+    Every write bumps the generation, and entries from an older generation are never served.
+    '''
+    _entries = OrderedDict()    # key -> (generation, result, size in bytes)
+    _size = 0
+    _generation = 0
+    _lock = Lock()
+    _MISS = object()
+
+    @classmethod
+    def generation(cls) -> int:
+        return cls._generation
+
+    @classmethod
+    def bump_generation(cls):
+        with cls._lock:
+            cls._generation += 1
+            cls._entries.clear()
+            cls._size = 0
+
+    @classmethod
+    def get(cls, key):
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is None:
+                return cls._MISS
+            if entry[0] != cls._generation:
+                cls._discard(key)
+                return cls._MISS
+            cls._entries.move_to_end(key)
+            return entry[1]
+
+    @classmethod
+    def put(cls, key, generation:int, result):
+        size = (
+            int(result.memory_usage(deep=True).sum()) if isinstance(result, pd.DataFrame)
+            else sys.getsizeof(result)
+        )
+        if size > QUERY_CACHE_MAX_BYTES:
+            return
+        with cls._lock:
+            # A write that finished while the query ran already made this result stale.
+            if generation != cls._generation:
+                return
+            if key in cls._entries:
+                cls._discard(key)
+            while cls._entries and cls._size + size > QUERY_CACHE_MAX_BYTES:
+                cls._discard(next(iter(cls._entries)))
+            cls._entries[key] = (generation, result, size)
+            cls._size += size
+
+    @classmethod
+    def _discard(cls, key):
+        cls._size -= cls._entries.pop(key)[2]
+
+def cached_query(method):
+    '''
+    Read-through QueryCache for a DBManager read method, keyed by the database, the method
+    and its arguments. Callers get a copy, so they can modify it freely.
+    '''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (
+            str(self.engine.url), method.__name__,
+            _hashable(args), _hashable(sorted(kwargs.items()))
+        )
+        result = QueryCache.get(key)
+        if result is QueryCache._MISS:
+            generation = QueryCache.generation()
+            result = method(self, *args, **kwargs)
+            QueryCache.put(key, generation, result)
+        else:
+            log.debug(f"Query cache hit for {method.__name__}")
+        return result.copy() if isinstance(result, pd.DataFrame) else copy.copy(result)
+    return wrapper
+
+def invalidates_cache(method):
+    '''
+    Bumps the QueryCache generation once a DBManager write method is done (or failed).
+    '''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            QueryCache.bump_generation()
+    return wrapper
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
 class DBManager():
+    # (database url, record column) -> {name: id} of the dimension tables, shared by
+    # every DBManager of the process.
+    _dim_cache = {}
+
     def __init__(self):
         db_name = 'studyanalytics.db'
         db_path = Path(__file__).resolve().parent.parent
         
-        self.engine = create_engine(f"sqlite:///{db_path}/{db_name}", echo=False)
+        self.engine = EngineRegistry.get_engine(f"sqlite:///{db_path}/{db_name}")
 
         self.session = sessionmaker(bind=self.engine)
         
+    @invalidates_cache
     def createTables(self):
         log.debug("Starting database")
+        if self._has_string_keys():
+            self._migrate_to_dim_keys()
+        self._drop_outdated_rollups()
         Base.metadata.create_all(self.engine)
 
+        # create_all() skips the indexes of tables that already exist.
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
+
+        if DAILY_SPARSE and self._user_version() < SPARSE_DAILY_VERSION:
+            self._compact_daily_data()
+
+    def _user_version(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+    def _compact_daily_data(self):
+        '''
+        One-time migration: deletes the zero-filled rows left in daily_data by the dense layout, 
+        and records it in the database's user_version.
+        '''
+        tbl = DailyDataTable.__table__
+        with self.engine.begin() as conn:
+            deleted = conn.execute(tbl.delete().where(
+                (tbl.c.time_spent_hrs == 0) | tbl.c.time_spent_hrs.is_(None) | tbl.c.subject_id.is_(None)
+            )).rowcount
+            conn.exec_driver_sql(f"PRAGMA user_version = {SPARSE_DAILY_VERSION}")
+        if deleted:
+            log.info(f"Removed {deleted} zero-filled rows from daily_data.")
+
+    def _has_string_keys(self) -> bool:
+        '''
+        Databases created before the dimension tables keyed main_data by the course, period,
+        subject and task_name strings themselves.
+        '''
+        inspector = inspect(self.engine)
+        return (
+            inspector.has_table('main_data')
+            and 'course' in {col['name'] for col in inspector.get_columns('main_data')}
+        )
+
+    def _migrate_to_dim_keys(self):
+        log.info("Migrating main and daily data to dimension ids.")
+        # weekly_data is not carried over: it is derived from daily_data and rebuilt from it
+        # (see Orchestrators.ensure_rollups()).
+        legacy_tables = {
+            'main_data': (MainDataTable, ['start_time', 'end_time']),
+            'daily_data': (DailyDataTable, ['date']),
+        }
+        # DDL is transactional in SQLite, so the old tables are only gone once the
+        # new ones hold their rows.
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE IF EXISTS weekly_data")
+            frames = {}
+            for name, (_, dates) in legacy_tables.items():
+                if inspect(conn).has_table(name):
+                    frames[name] = pd.read_sql(f"SELECT * FROM {name}", conn, parse_dates=dates)
+                    conn.exec_driver_sql(f"DROP TABLE {name}")
+
+            Base.metadata.create_all(conn)
+            for name, df in frames.items():
+                table_cls = legacy_tables[name][0]
+                df = df.drop(columns=['id'], errors='ignore').astype(object)
+                df = df.where(df.notna(), None)
+                self._insert_records(conn, table_cls, df.to_dict(orient='records'))
+                log.debug(f"Migrated {len(df)} rows of {name}.")
+
+    def _drop_outdated_rollups(self):
+        '''
+        weekly_data used to be keyed by an autoincrement id, which duplicated rows on every
+        reinsert; its rows are derived, so the table is simply recreated.
+        '''
+        inspector = inspect(self.engine)
+        if inspector.has_table('weekly_data') and 'id' in {col['name'] for col in inspector.get_columns('weekly_data')}:
+            log.info("Dropping weekly_data with the old id key, it will be rebuilt from daily_data.")
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql("DROP TABLE weekly_data")
+
+    def is_empty(self, table:str) -> bool:
+        tbl = TABLE_MAP[table].__table__
+        with self.engine.connect() as conn:
+            return not conn.execute(select(exists().select_from(tbl))).scalar()
+
+    def _dim_ids(self, conn, column:str, reload:bool = False) -> dict:
+        '''
+        {name: id} of the dimension table behind record `column` (see DIM_KEYS),
+        read once and then served from the cache.
+        '''
+        key = (str(self.engine.url), column)
+        ids = DBManager._dim_cache.get(key)
+        if ids is None or reload:
+            tbl = DIM_TABLES[column].__table__
+            ids = dict(conn.execute(select(tbl.c.name, tbl.c.id)).all())
+            DBManager._dim_cache[key] = ids
+        return ids
+
+    def _dim_id(self, conn, column:str, name:str) -> int:
+        '''
+        Id of `name`, or -1 (matches no row) when it is not in the dimension table.
+        '''
+        ids = self._dim_ids(conn, column)
+        if name not in ids:
+            ids = self._dim_ids(conn, column, reload=True)
+        return ids.get(name, -1)
+
+    def _ensure_dim_ids(self, conn, column:str, names) -> dict:
+        ids = self._dim_ids(conn, column)
+        missing = [name for name in set(names) if not pd.isna(name) and name not in ids]
+        if missing:
+            tbl = DIM_TABLES[column].__table__
+            conn.execute(
+                sqlite_insert(tbl).on_conflict_do_nothing(index_elements=['name']),
+                [{"name": name} for name in missing]
+            )
+            ids = self._dim_ids(conn, column, reload=True)
+        return ids
+
+    def _forget_dim_ids(self):
+        '''
+        Drops the cached ids, e.g. when a transaction that inserted new ones rolled back.
+        '''
+        for key in [key for key in DBManager._dim_cache if key[0] == str(self.engine.url)]:
+            del DBManager._dim_cache[key]
+
+    def _to_dim_keys(self, conn, records: list[dict]) -> list[dict]:
+        '''
+        Replaces the course/period/subject/task_name strings of `records` by their
+        dimension ids, adding the names not seen before.
+        '''
+        if not records:
+            return records
+        columns = [col for col in DIM_KEYS if col in records[0]]
+        if not columns:
+            return records
+
+        ids = {col: self._ensure_dim_ids(conn, col, (r[col] for r in records)) for col in columns}
+        keyed = []
+        for record in records:
+            record = dict(record)
+            for col in columns:
+                record[DIM_KEYS[col]] = ids[col].get(record.pop(col))
+            keyed.append(record)
+        return keyed
+
+    def _from_dim_keys(self, conn, df: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Maps the id columns read as course/period/subject/task_name back to their names.
+        '''
+        for col in DIM_KEYS:
+            if col not in df.columns:
+                continue
+            names = {id_: name for name, id_ in self._dim_ids(conn, col).items()}
+            if not df[col].dropna().isin(names.keys()).all():
+                names = {id_: name for name, id_ in self._dim_ids(conn, col, reload=True).items()}
+            df[col] = df[col].map(names)
+        return df
+
+    def _insert_records(self, conn, table_cls, records: list[dict]):
+        if records:
+            conn.execute(table_cls.__table__.insert(), self._to_dim_keys(conn, records))
+
+    @invalidates_cache
     def insert_to_main_data(self, df: pd.DataFrame):
         '''
         Used for bulk insert of data into table.
@@ -30,51 +378,154 @@ class DBManager():
         Use upsert function instead.
         '''
         log.debug("Inserting to main_data table.")
-        session = self.session()
         try:
             records = df.to_dict(orient='records')
-            session.bulk_insert_mappings(MainDataTable, records)
-            session.commit()
+            with self.engine.begin() as conn:
+                self._insert_records(conn, MainDataTable, records)
             log.debug(f"Inserted a total of {len(records)} to db.")
         except:
-            session.rollback()
+            self._forget_dim_ids()
             log.error("Error while trying to insert dataframe into main_data table"
                       f"\n\tdataframe:\n{df.info}\n")
             raise
-        finally:
-            session.close() 
-    
+
     def upsert_to_tables(self, table:str, df: pd.DataFrame):
         '''
-        Accepts 'main', 'daily', 'weekly' for tables.
+        Accepts 'main', 'daily', 'weekly', 'monthly' for tables.
         '''
-        session = self.session()
+        records = (
+            dict(zip(df.columns, row)) 
+            for row in df.itertuples(index=False, name=None)
+        )
+        self.upsert_records(table=table, records=records)
 
-        TABLE_MAP = {
-            'main': MainDataTable,
-            'daily': DailyDataTable,
-            'weekly': WeeklyDataTable,
-        }
-        tbl = TABLE_MAP[table]
+    @invalidates_cache
+    def upsert_records(self, table:str, records, batch_size:int = UPSERT_BATCH_SIZE) -> int:
+        '''
+        Upserts an iterable (or generator) of record dicts into 'main', 'daily', 'weekly',
+        'monthly' or 'sp_task_state'.
+        Records are consumed lazily and written `batch_size` at a time as a single
+        INSERT ... ON CONFLICT DO UPDATE executemany, all within one transaction.
+        Names in course/period/subject/task_name are stored as their dimension ids.
+        '''
+        tbl = TABLE_MAP[table].__table__
+        try:
+            with self.engine.begin() as conn:
+                count = self._upsert_batches(conn, tbl, records, batch_size)
+
+            log.debug(f"Upserted a total of {count} records to {table} table.")
+        except:
+            self._forget_dim_ids()
+            log.error(f"Error occurring while tying to upsert into table {table}")
+            raise
+
+        return count
+
+    def _upsert_batches(self, conn, tbl, records, batch_size:int) -> int:
+        pk_cols = [col.name for col in tbl.primary_key.columns]
+
+        records = iter(records)
+        count = 0
+        while batch := list(islice(records, batch_size)):
+            batch = self._to_dim_keys(conn, batch)
 
+            stmt = sqlite_insert(tbl)
+            update_cols = {
+                col: stmt.excluded[col] for col in batch[0] if col not in pk_cols
+            }
+            if update_cols:
+                stmt = stmt.on_conflict_do_update(index_elements=pk_cols, set_=update_cols)
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=pk_cols)
+
+            conn.execute(stmt, batch)
+            count += len(batch)
+
+        return count
+
+    @invalidates_cache
+    def replace_rollups(self, weekly_df: pd.DataFrame, monthly_df: pd.DataFrame, windows: list[tuple]) -> None:
+        '''
+        Replaces, in one transaction, the weekly/monthly rows of each window by those in 
+        `weekly_df`/`monthly_df`. A window is (course, period, first week, last week, 
+        first month, last month), with weeks and months as stored (e.g. '2025-05-12/2025-05-18', 
+        '2025-05'); a None last week/month leaves it open-ended.
+        Rows of the window missing from the frames (e.g. a week whose only hours were 
+        removed) are deleted.
+        '''
+        rollups = (
+            (WeeklyDataTable.__table__, "week", weekly_df, 2),
+            (MonthlyDataTable.__table__, "month", monthly_df, 4),
+        )
         try:
-            for record in df.to_dict(orient="records"):
-                # Create a transient instance…
-                obj = tbl(**record)
-                # …then merge() will INSERT if no PK/unique key match exists,
-                # or UPDATE the existing row otherwise.
-                session.merge(obj)
+            with self.engine.begin() as conn:
+                for tbl, grain_col, df, bound in rollups:
+                    for window in windows:
+                        course, period, first, last = window[0], window[1], window[bound], window[bound + 1]
+                        stmt = tbl.delete().where(
+                            (tbl.c.course_id == self._dim_id(conn, "course", course))
+                            & (tbl.c.period_id == self._dim_id(conn, "period", period))
+                            & (tbl.c[grain_col] >= first)
+                        )
+                        if last is not None:
+                            stmt = stmt.where(tbl.c[grain_col] <= last)
+                        conn.execute(stmt)
 
-                # log.debug(f"Upsert to db {record}")
+                    records = (
+                        dict(zip(df.columns, row)) 
+                        for row in df.itertuples(index=False, name=None)
+                    )
+                    count = self._upsert_batches(conn, tbl, records, UPSERT_BATCH_SIZE)
+                    log.debug(f"Replaced {len(windows)} windows with {count} rows in {tbl.name}.")
+        except:
+            self._forget_dim_ids()
+            log.error("Error while trying to replace weekly/monthly rollups")
+            raise
 
-            session.commit()
+    @invalidates_cache
+    def apply_daily_delta(self, df: pd.DataFrame) -> int:
+        '''
+        Upserts the daily cells in `df` (e.g. from DFTransformers.daily_delta()). 
+        With DAILY_SPARSE the cells down to 0 hours are deleted instead.
+        '''
+        tbl = DailyDataTable.__table__
+        to_delete = df.iloc[0:0]
+        if DAILY_SPARSE:
+            to_delete = df.drop(self._drop_zero_days(df).index)
+            df = self._drop_zero_days(df)
+
+        try:
+            with self.engine.begin() as conn:
+                if not to_delete.empty:
+                    keys = self._to_dim_keys(conn, to_delete[['course', 'period', 'subject', 'date']].to_dict(orient='records'))
+                    conn.execute(
+                        tbl.delete().where(
+                            (tbl.c.course_id == bindparam('b_course_id'))
+                            & (tbl.c.period_id == bindparam('b_period_id'))
+                            & (tbl.c.subject_id == bindparam('b_subject_id'))
+                            & (tbl.c.date == bindparam('b_date', type_=tbl.c.date.type))
+                        ),
+                        [{f"b_{col}": val for col, val in key.items()} for key in keys]
+                    )
+                records = (
+                    dict(zip(df.columns, row)) 
+                    for row in df.itertuples(index=False, name=None)
+                )
+                count = self._upsert_batches(conn, tbl, records, UPSERT_BATCH_SIZE)
+
+            log.debug(f"Upserted {count} and deleted {len(to_delete)} daily rows.")
         except:
-            session.rollback()
-            log.error(f"Error occurring while tying to upsert into table {table}")
+            self._forget_dim_ids()
+            log.error("Error while trying to apply a delta to daily_data")
             raise
-        finally:
-            session.close()
 
+        return count
+
+    @staticmethod
+    def _drop_zero_days(df: pd.DataFrame) -> pd.DataFrame:
+        return df[(df['time_spent_hrs'] != 0) & df['time_spent_hrs'].notna() & df['subject'].notna()]
+
+    @invalidates_cache
     def insert_period_data(self, course:str, period:str, start_date:DateTime, finished:bool = True):
         log.debug("Inserting to period_data table.")
         session = self.session()
@@ -93,80 +544,456 @@ class DBManager():
         finally:
             session.close() 
 
+    @invalidates_cache
     def insert_daily_data(self, df: pd.DataFrame):
         log.debug("Inserting to daily_data table.")
-        session = self.session()
+        if DAILY_SPARSE:
+            df = self._drop_zero_days(df)
         try:
-            records = df.to_dict(orient='records')
-            session.bulk_insert_mappings(DailyDataTable, records)
-            session.commit()
+            with self.engine.begin() as conn:
+                self._insert_records(conn, DailyDataTable, df.to_dict(orient='records'))
         except:
-            session.rollback()
+            self._forget_dim_ids()
             log.error("Error while trying to insert dataframe into daily_data table"
                       f"\n\tdataframe:\n{df.info}\n")
             raise
-        finally:
-            session.close()
 
     def insert_weekly_data(self, df: pd.DataFrame):
+        '''
+        Weeks are keyed by (course, period, subject, week), so this is an upsert: 
+        reinserting a week replaces it.
+        '''
         log.debug("Inserting to weekly_data table.")
-        session = self.session()
-        try:
-            records = df.to_dict(orient='records')
-            session.bulk_insert_mappings(WeeklyDataTable, records)
-            session.commit()
-        except:
-            session.rollback()
-            log.error("Error while trying to insert dataframe into weekly_data table"
-                      f"\n\tdataframe:\n{df.info}\n")
-            raise
-        finally:
-            session.close()
+        self.upsert_to_tables(table='weekly', df=df)
 
+    @cached_query
     def get_daily_data(self,
         course: str | None = None,
         period: str | None = None,
-        subject: str | None = None
+        subject: str | None = None,
+        columns: list[str] | None = None,
+        start_date: DateTime | None = None,
+        end_date: DateTime | None = None,
+        densify: bool = True,
+        hours_dtype: str = HOURS_DTYPE
     ) -> pd.DataFrame:
-        session = self.session()
-        query = session.query(DailyDataTable)
+        '''
+        Reads daily_data straight into typed columns (no ORM objects).
+        `columns` projects a subset of DAILY_COLUMNS, `start_date`/`end_date` are inclusive.
+        Hours are `hours_dtype`: float32 for charts and stats, float64 when they are summed 
+        into stored totals.
+        With `densify` (and no `subject`), every day from the period start to its last day is 
+        present: days without hours get a single row with no subject and 0 hours.
+        '''
+        columns = list(columns or DAILY_COLUMNS)
+        densify = densify and subject is None
+
+        with self.engine.connect() as conn:
+            stmt = self._daily_select(
+                *self._filter_ids(conn, course=course, period=period, subject=subject),
+                DAILY_COLUMNS if densify else columns, start_date, end_date
+            )
+            df = pd.read_sql(stmt, conn)
+            df = self._from_dim_keys(conn, df)
+        df = self._type_daily_frame(df)
 
+        if densify:
+            df = self._densify_daily(df, self._daily_ranges(course, period, start_date, end_date))
+            df = df[columns]
+        return DtypePolicy.apply(df, "get_daily_data", hours_dtype=hours_dtype)
+
+    def _daily_ranges(self, course, period, start_date, end_date) -> pd.DataFrame:
+        '''
+        First and last day to densify of each (course, period): from its start in period_data
+        (or its first stored day) to its last stored day, clipped to `start_date`/`end_date`.
+        '''
+        ranges = self.get_period_totals()[["course", "period", "first_day", "last_day"]]
         if course is not None:
-            query = query.filter(DailyDataTable.course == course)
+            ranges = ranges[ranges["course"] == course]
         if period is not None:
-            query = query.filter(DailyDataTable.period == period)
-        if subject is not None:
-            query = query.filter(DailyDataTable.subject == subject)
-
-        results = query.all()
-
-        records = [
-            {
-                # "id":       row.id,
-                "date":     row.date,
-                "course":   row.course,
-                "period":   row.period,
-                "subject":  row.subject,
-                "time_spent_hrs": row.time_spent_hrs
-            }
-            for row in results
+            ranges = ranges[ranges["period"] == period]
+        if ranges.empty:
+            return ranges.assign(start=ranges["first_day"], end=ranges["last_day"])[["course", "period", "start", "end"]]
+
+        period_starts = self.get_period_starts()
+        starts = pd.Series([
+            min(period_starts.get((c, p), first_day), first_day)
+            for c, p, first_day in zip(ranges["course"], ranges["period"], ranges["first_day"])
+        ], index=ranges.index, dtype=ranges["first_day"].dtype)
+        ranges = ranges.assign(start=starts, end=ranges["last_day"])
+        if start_date is not None:
+            ranges["start"] = ranges["start"].clip(lower=pd.Timestamp(start_date))
+        if end_date is not None:
+            ranges["end"] = ranges["end"].clip(upper=pd.Timestamp(end_date))
+
+        return ranges.loc[ranges["start"] <= ranges["end"], ["course", "period", "start", "end"]]
+
+    @staticmethod
+    def _densify_daily(df: pd.DataFrame, ranges: pd.DataFrame) -> pd.DataFrame:
+        if ranges.empty:
+            return df
+
+        # Every (course, period, day) of the ranges, built with datetime64 arithmetic.
+        lengths = ((ranges["end"] - ranges["start"]).dt.days + 1).to_numpy()
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        full = pd.DataFrame({
+            "course": np.repeat(ranges["course"].to_numpy(), lengths),
+            "period": np.repeat(ranges["period"].to_numpy(), lengths),
+            "date": np.repeat(ranges["start"].to_numpy(), lengths) + offsets.astype("timedelta64[D]"),
+        }).astype({"course": df["course"].dtype, "period": df["period"].dtype, "date": df["date"].dtype})
+
+        present = df[["course", "period", "date"]].drop_duplicates()
+        missing = full.merge(present, how="left", indicator=True)
+        missing = missing.loc[missing["_merge"] == "left_only", ["course", "period", "date"]]
+        if missing.empty:
+            return df
+
+        fillers = missing.assign(subject=np.nan, time_spent_hrs=0.0)[df.columns]
+        return (
+            pd.concat([df, fillers.astype(df.dtypes.to_dict())], ignore_index=True)
+            .sort_values("date", kind="stable", ignore_index=True)
+        )
+
+    def iter_daily_data(self,
+        course: str | None = None,
+        period: str | None = None,
+        subject: str | None = None,
+        columns: list[str] | None = None,
+        start_date: DateTime | None = None,
+        end_date: DateTime | None = None,
+        chunksize: int = DAILY_READ_CHUNK
+    ):
+        '''
+        Same as get_daily_data(), but yields DataFrames of at most `chunksize` rows, 
+        fetched from the cursor as they are consumed.
+        '''
+        with self.engine.connect() as conn:
+            stmt = self._daily_select(
+                *self._filter_ids(conn, course=course, period=period, subject=subject),
+                columns, start_date, end_date
+            )
+            conn = conn.execution_options(yield_per=chunksize)
+            for df in pd.read_sql(stmt, conn, chunksize=chunksize):
+                df = self._type_daily_frame(self._from_dim_keys(conn, df))
+                yield DtypePolicy.apply(df, "iter_daily_data")
+
+    def _filter_ids(self, conn, **names) -> list:
+        return [
+            None if name is None else self._dim_id(conn, col, name)
+            for col, name in names.items()
         ]
-        df = pd.DataFrame.from_records(records)
 
-        # 5) Ensure datetime dtype
-        df["date"] = pd.to_datetime(df["date"])
+    @staticmethod
+    def _daily_select(course_id, period_id, subject_id, columns, start_date, end_date):
+        tbl = DailyDataTable.__table__
 
-        return df
+        # The date is selected as its stored text and parsed in one go by pandas, 
+        # instead of row by row by the DateTime result processor.
+        stmt = select(*[
+            type_coerce(tbl.c[col], String).label(col) if col == "date"
+            else tbl.c[DIM_KEYS.get(col, col)].label(col)
+            for col in (columns or DAILY_COLUMNS)
+        ])
+        stmt = DBManager._daily_where(stmt, course_id, period_id, subject_id, start_date, end_date)
+
+        return stmt.order_by(tbl.c.date)
+
+    @staticmethod
+    def _daily_where(stmt, course_id, period_id, subject_id, start_date, end_date):
+        tbl = DailyDataTable.__table__
+
+        if course_id is not None:
+            stmt = stmt.where(tbl.c.course_id == course_id)
+        if period_id is not None:
+            stmt = stmt.where(tbl.c.period_id == period_id)
+        if subject_id is not None:
+            stmt = stmt.where(tbl.c.subject_id == subject_id)
+        if start_date is not None:
+            stmt = stmt.where(tbl.c.date >= start_date)
+        if end_date is not None:
+            stmt = stmt.where(tbl.c.date <= end_date)
+
+        return stmt
+
+    @staticmethod
+    def _type_daily_frame(df: pd.DataFrame) -> pd.DataFrame:
+        if "date" in df.columns:
+            df["date"] = pd.to_datetime(df["date"], format=SQLITE_DATETIME_FORMAT)
+
+        return df.astype({col: dtype for col, dtype in DAILY_DTYPES.items() if col in df.columns})
+
+    @cached_query
+    def get_last_day(self,
+        course: str | None = None,
+        period: str | None = None
+    ) -> pd.Timestamp | None:
+        '''
+        Latest date in daily_data, or None when there is none.
+        '''
+        with self.engine.connect() as conn:
+            last_day = conn.execute(self._last_day_select(
+                *self._filter_ids(conn, course=course, period=period)
+            )).scalar()
+
+        return None if last_day is None else pd.to_datetime(last_day, format=SQLITE_DATETIME_FORMAT)
+
+    @staticmethod
+    def _last_day_select(course_id, period_id):
+        tbl = DailyDataTable.__table__
+        stmt = select(func.max(type_coerce(tbl.c.date, String)))
+        return DBManager._daily_where(stmt, course_id, period_id, None, None, None)
+
+    @cached_query
+    def get_day_hours(self,
+        day: DateTime,
+        course: str | None = None,
+        period: str | None = None
+    ) -> float:
+        '''
+        Hours logged on `day` (a midnight datetime, as stored in daily_data).
+        '''
+        with self.engine.connect() as conn:
+            return conn.execute(self._day_hours_select(
+                *self._filter_ids(conn, course=course, period=period), day
+            )).scalar()
+
+    @staticmethod
+    def _day_hours_select(course_id, period_id, day):
+        tbl = DailyDataTable.__table__
+        stmt = select(func.coalesce(func.sum(tbl.c.time_spent_hrs), 0.0))
+        return DBManager._daily_where(stmt, course_id, period_id, None, day, day)
+
+    @cached_query
+    def get_subject_totals(self,
+        course: str | None = None,
+        period: str | None = None,
+        start_date: DateTime | None = None,
+        end_date: DateTime | None = None
+    ) -> pd.DataFrame:
+        '''
+        Hours per course, period and subject, optionally between two (inclusive) dates.
+        '''
+        tbl = DailyDataTable.__table__
+        with self.engine.connect() as conn:
+            stmt = select(
+                tbl.c.course_id.label("course"),
+                tbl.c.period_id.label("period"),
+                tbl.c.subject_id.label("subject"),
+                func.sum(tbl.c.time_spent_hrs).label("time_spent_hrs")
+            )
+            stmt = self._daily_where(
+                stmt, *self._filter_ids(conn, course=course, period=period), None, start_date, end_date
+            ).where(tbl.c.subject_id.is_not(None))
+            stmt = stmt.group_by(tbl.c.course_id, tbl.c.period_id, tbl.c.subject_id)
+
+            df = self._from_dim_keys(conn, pd.read_sql(stmt, conn))
+
+        return DtypePolicy.apply(df, "get_subject_totals")
+
+    @cached_query
+    def get_period_totals(self) -> pd.DataFrame:
+        '''
+        Hours, first and last day of every course and period.
+        '''
+        tbl = DailyDataTable.__table__
+        stmt = (
+            select(
+                tbl.c.course_id.label("course"),
+                tbl.c.period_id.label("period"),
+                func.min(type_coerce(tbl.c.date, String)).label("first_day"),
+                func.max(type_coerce(tbl.c.date, String)).label("last_day"),
+                func.sum(tbl.c.time_spent_hrs).label("time_spent_hrs")
+            )
+            .group_by(tbl.c.course_id, tbl.c.period_id)
+        )
+        with self.engine.connect() as conn:
+            df = self._from_dim_keys(conn, pd.read_sql(stmt, conn))
+
+        for col in ("first_day", "last_day"):
+            df[col] = pd.to_datetime(df[col], format=SQLITE_DATETIME_FORMAT)
+        return df.astype({"course": "str", "period": "str", "time_spent_hrs": "float64"})
+
+    @cached_query
+    def get_weekly_data(self,
+        course: str | None = None,
+        period: str | None = None,
+        subject: str | None = None
+    ) -> pd.DataFrame:
+        '''
+        Precomputed Mon-Sun totals, columns: course, period, subject, week, week_number, time_spent_hrs.
+        '''
+        return self._get_rollup(WeeklyDataTable, ("week", "week_number"), course, period, subject)
+
+    @cached_query
+    def get_monthly_data(self,
+        course: str | None = None,
+        period: str | None = None,
+        subject: str | None = None
+    ) -> pd.DataFrame:
+        '''
+        Precomputed calendar month totals, columns: course, period, subject, month, time_spent_hrs.
+        '''
+        return self._get_rollup(MonthlyDataTable, ("month",), course, period, subject)
+
+    def _get_rollup(self, table_cls, grain_cols: tuple, course, period, subject) -> pd.DataFrame:
+        tbl = table_cls.__table__
+        stmt = select(
+            tbl.c.course_id.label("course"),
+            tbl.c.period_id.label("period"),
+            tbl.c.subject_id.label("subject"),
+            *[tbl.c[col] for col in grain_cols],
+            tbl.c.time_spent_hrs
+        )
+        with self.engine.connect() as conn:
+            course_id, period_id, subject_id = self._filter_ids(conn, course=course, period=period, subject=subject)
+            if course_id is not None:
+                stmt = stmt.where(tbl.c.course_id == course_id)
+            if period_id is not None:
+                stmt = stmt.where(tbl.c.period_id == period_id)
+            if subject_id is not None:
+                stmt = stmt.where(tbl.c.subject_id == subject_id)
+
+            df = pd.read_sql(stmt.order_by(tbl.c[grain_cols[0]]), conn)
+            df = self._from_dim_keys(conn, df)
+
+        return DtypePolicy.apply(df, f"get_{table_cls.__tablename__}")
+
+    @cached_query
+    def get_period_starts(self) -> dict[tuple, pd.Timestamp]:
+        '''
+        Start date of each (course, period) in period_data (the earliest one if repeated).
+        '''
+        tbl = PeriodDataTable.__table__
+        stmt = (
+            select(tbl.c.course, tbl.c.period, func.min(type_coerce(tbl.c.start_date, String)))
+            .group_by(tbl.c.course, tbl.c.period)
+        )
+        with self.engine.connect() as conn:
+            rows = conn.execute(stmt).all()
+
+        return {
+            (course, period): pd.to_datetime(start, format="ISO8601").normalize()
+            for course, period, start in rows if start is not None
+        }
+
+    @cached_query
+    def get_first_days(self) -> dict[tuple, pd.Timestamp]:
+        '''
+        First day in daily_data of each (course, period).
+        '''
+        tbl = DailyDataTable.__table__
+        stmt = (
+            select(tbl.c.course_id, tbl.c.period_id, func.min(type_coerce(tbl.c.date, String)))
+            .group_by(tbl.c.course_id, tbl.c.period_id)
+        )
+        with self.engine.connect() as conn:
+            df = pd.read_sql(stmt, conn)
+            df.columns = ["course", "period", "date"]
+            df = self._from_dim_keys(conn, df)
+
+        df["date"] = pd.to_datetime(df["date"], format=SQLITE_DATETIME_FORMAT)
+        return {(row.course, row.period): row.date for row in df.itertuples()}
+
+    def get_sp_task_states(self) -> dict[str, dict]:
+        '''
+        Map of SP task id -> {"digest", "time_spent_on_day"} stored on the last sync.
+        '''
+        session = self.session()
+        try:
+            return {
+                row.task_id: {
+                    "digest": row.digest,
+                    "time_spent_on_day": row.time_spent_on_day
+                }
+                for row in session.query(SPTaskStateTable).all()
+            }
+        finally:
+            session.close() 
+
+    def get_main_data(self,
+        course: str | None = None,
+        period: str | None = None,
+        start_from: DateTime | None = None,
+        end_before: DateTime | None = None
+    ) -> pd.DataFrame:
+        with self.engine.connect() as conn:
+            stmt = self._main_select(
+                *self._filter_ids(conn, course=course, period=period),
+                start_from, end_before
+            )
+            df = pd.read_sql(stmt, conn)
+            df = self._from_dim_keys(conn, df)
+
+        df["start_time"] = pd.to_datetime(df["start_time"], format=SQLITE_DATETIME_FORMAT)
+        df["end_time"] = pd.to_datetime(df["end_time"], format=SQLITE_DATETIME_FORMAT)
+
+        return DtypePolicy.apply(df.astype(MAIN_DTYPES), "get_main_data", hours_dtype="float64")
+
+    @staticmethod
+    def _main_select(course_id, period_id, start_from, end_before=None):
+        tbl = MainDataTable.__table__
+
+        stmt = select(*[
+            type_coerce(tbl.c[col], String).label(col) if col in ("start_time", "end_time")
+            else tbl.c[DIM_KEYS.get(col, col)].label(col)
+            for col in MAIN_COLUMNS
+        ])
+
+        if course_id is not None:
+            stmt = stmt.where(tbl.c.course_id == course_id)
+        if period_id is not None:
+            stmt = stmt.where(tbl.c.period_id == period_id)
+        if start_from is not None:
+            stmt = stmt.where(tbl.c.start_time >= start_from)
+        if end_before is not None:
+            stmt = stmt.where(tbl.c.start_time < end_before)
+
+        return stmt
+
+class CourseDimTable(Base):
+    __tablename__ = 'dim_course'
+    id              = Column(Integer, 
+                        primary_key=True, 
+                        autoincrement=True)
+    name            = Column(String, unique=True, nullable=False)
+
+class PeriodDimTable(Base):
+    __tablename__ = 'dim_period'
+    id              = Column(Integer, 
+                        primary_key=True, 
+                        autoincrement=True)
+    name            = Column(String, unique=True, nullable=False)
+
+class SubjectDimTable(Base):
+    __tablename__ = 'dim_subject'
+    id              = Column(Integer, 
+                        primary_key=True, 
+                        autoincrement=True)
+    name            = Column(String, unique=True, nullable=False)
+
+class TaskDimTable(Base):
+    __tablename__ = 'dim_task'
+    id              = Column(Integer, 
+                        primary_key=True, 
+                        autoincrement=True)
+    name            = Column(String, unique=True, nullable=False)
+
+DIM_TABLES = {
+    "course": CourseDimTable,
+    "period": PeriodDimTable,
+    "subject": SubjectDimTable,
+    "task_name": TaskDimTable,
+}
 
 class MainDataTable(Base):
     __tablename__ = 'main_data'
-    course          = Column(String, 
+    course_id       = Column(Integer, ForeignKey('dim_course.id'), 
                         primary_key=True)
-    period          = Column(String, 
+    period_id       = Column(Integer, ForeignKey('dim_period.id'), 
                         primary_key=True)
-    subject         = Column(String, 
+    subject_id      = Column(Integer, ForeignKey('dim_subject.id'), 
                         primary_key=True)
-    task_name       = Column(String, 
+    task_id         = Column(Integer, ForeignKey('dim_task.id'), 
                         primary_key=True)
     start_time      = Column(DateTime(timezone=True), 
                         primary_key=True)
@@ -174,6 +1001,10 @@ class MainDataTable(Base):
     time_spent_hrs  = Column(Float)
     finished        = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index('ix_main_course_period_start', 'course_id', 'period_id', 'start_time'),
+    )
+
 class PeriodDataTable(Base):
     __tablename__   = 'period_data'
     id              = Column(Integer, 
@@ -188,21 +1019,60 @@ class DailyDataTable(Base):
     __tablename__ = 'daily_data'
     date            = Column(DateTime(timezone=True), 
                         primary_key=True)
-    course          = Column(String, 
+    course_id       = Column(Integer, ForeignKey('dim_course.id'), 
                         primary_key=True)
-    period          = Column(String, 
+    period_id       = Column(Integer, ForeignKey('dim_period.id'), 
                         primary_key=True)
-    subject         = Column(String, 
+    subject_id      = Column(Integer, ForeignKey('dim_subject.id'), 
                         primary_key=True,nullable=True)
     time_spent_hrs  = Column(Float)
 
+    # Both cover every column, so per-period and per-subject reads never touch the table.
+    __table_args__ = (
+        Index('ix_daily_course_period_date', 'course_id', 'period_id', 'date', 'subject_id', 'time_spent_hrs'),
+        Index('ix_daily_subject_date', 'subject_id', 'date', 'course_id', 'period_id', 'time_spent_hrs'),
+    )
+
 class WeeklyDataTable(Base):
     __tablename__ = 'weekly_data'
-    id              = Column(Integer, 
+    course_id       = Column(Integer, ForeignKey('dim_course.id'), 
+                        primary_key=True)
+    period_id       = Column(Integer, ForeignKey('dim_period.id'), 
+                        primary_key=True)
+    subject_id      = Column(Integer, ForeignKey('dim_subject.id'), 
+                        primary_key=True)
+    week            = Column(String,    # Mon-Sun, e.g. '2025-01-13/2025-01-19'
                         primary_key=True)
-    course          = Column(String)
-    period          = Column(String)
-    subject         = Column(String)
     week_number     = Column(Integer)
-    week            = Column(String)
-    time_spent_hrs  = Column(Float)
\ No newline at end of file
+    time_spent_hrs  = Column(Float)
+
+class MonthlyDataTable(Base):
+    __tablename__ = 'monthly_data'
+    course_id       = Column(Integer, ForeignKey('dim_course.id'), 
+                        primary_key=True)
+    period_id       = Column(Integer, ForeignKey('dim_period.id'), 
+                        primary_key=True)
+    subject_id      = Column(Integer, ForeignKey('dim_subject.id'), 
+                        primary_key=True)
+    month           = Column(String,    # e.g. '2025-01'
+                        primary_key=True)
+    time_spent_hrs  = Column(Float)
+
+class SPTaskStateTable(Base):
+    '''
+    Per SuperProductivity task digest of the last synced state, used to only upsert
+    the tasks (and days) that changed.
+    '''
+    __tablename__ = 'sp_task_state'
+    task_id         = Column(String, 
+                        primary_key=True)
+    digest          = Column(String)
+    time_spent_on_day = Column(String)  # json {day: ms}
+
+TABLE_MAP = {
+    'main': MainDataTable,
+    'daily': DailyDataTable,
+    'weekly': WeeklyDataTable,
+    'monthly': MonthlyDataTable,
+    'sp_task_state': SPTaskStateTable,
+}
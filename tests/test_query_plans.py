@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from data.sqlalchemy import DBManager, EngineRegistry
+
+DAY = datetime(2000, 1, 1)
+
+# The app's filtered reads, with sample ids and dates.
+KNOWN_QUERIES = {
+    "daily by period":          DBManager._daily_select(1, 1, None, None, None, None),
+    "daily by period and date": DBManager._daily_select(1, 1, None, None, DAY, DAY),
+    "daily by subject":         DBManager._daily_select(None, None, 1, None, None, None),
+    "daily by date":            DBManager._daily_select(None, None, None, None, DAY, DAY),
+    "main by period from date": DBManager._main_select(1, 1, DAY),
+    "last day of period":       DBManager._last_day_select(1, 1),
+    "hours on a day":           DBManager._day_hours_select(None, None, DAY),
+}
+
+@pytest.fixture
+def db(tmp_path):
+    db = DBManager.__new__(DBManager)
+    db.engine = EngineRegistry.get_engine(f"sqlite:///{tmp_path / 'studyanalytics.db'}")
+    db.session = sessionmaker(bind=db.engine)
+    db.createTables()
+    yield db
+    db.engine.dispose()
+
+@pytest.mark.parametrize("name", KNOWN_QUERIES)
+def test_query_plan_has_no_full_scan(db, name):
+    sql = KNOWN_QUERIES[name].compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+    with db.engine.connect() as conn:
+        details = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+    # Every known query filters on an index prefix, so it should be a SEARCH;
+    # a SCAN (even "USING INDEX", e.g. to satisfy the ORDER BY) reads all rows.
+    assert not any(d.startswith("SCAN ") for d in details), details
@@ -0,0 +1,49 @@
+import logging
+
+import pandas as pd
+
+from utils.logger import LoggerSingleton
+log = LoggerSingleton().get_logger()
+
+CATEGORY_COLUMNS = ("course", "period", "subject", "task_name")
+HOURS_COLUMNS = ("time_spent_hrs",)
+DAY_COLUMNS = ("date",)
+HOURS_DTYPE = "float32"
+DAY_DTYPE = "datetime64[s]"
+
+class DtypePolicy:
+    '''
+    Dtypes shared by the frames of the import -> transform -> read pipeline:
+        - course, period, subject and task_name: categoricals (one code per row instead
+          of a repeated Python string)
+        - time_spent_hrs: float32 in frames read for charts and stats; float64 where
+          hours are summed into values that are stored (task rows, daily and weekly totals)
+        - date: datetime64[s] days
+
+    Groupbys over these frames must pass observed=True, so that only the category
+    combinations present are grouped.
+    '''
+    @staticmethod
+    def apply(df:pd.DataFrame, stage:str, hours_dtype:str = HOURS_DTYPE) -> pd.DataFrame:
+        '''
+        Casts the columns of `df` covered by the policy, and logs its memory usage at `stage`.
+        '''
+        dtypes = {}
+        for col in df.columns:
+            if col in CATEGORY_COLUMNS and not isinstance(df[col].dtype, pd.CategoricalDtype):
+                dtypes[col] = "category"
+            elif col in HOURS_COLUMNS:
+                dtypes[col] = hours_dtype
+            elif col in DAY_COLUMNS:
+                dtypes[col] = DAY_DTYPE
+
+        df = df.astype(dtypes) if dtypes else df
+        DtypePolicy.report(df, stage)
+        return df
+
+    @staticmethod
+    def report(df:pd.DataFrame, stage:str):
+        # memory_usage(deep=True) walks every object cell, so it only runs when logged.
+        if log.isEnabledFor(logging.DEBUG):
+            size = df.memory_usage(deep=True).sum()
+            log.debug(f"{stage}: {len(df)} rows, {size/1024:.1f} KiB")